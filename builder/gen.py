@@ -3,9 +3,26 @@
 import sys
 import os
 import json
-import re
+import time
+import hashlib
+import functools
+import argparse
+import threading
 import subprocess
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+
+FORMAT_JOBS = os.cpu_count() or 1
+# tools called by format/formatter, their versions change the formatted output
+FORMAT_TOOLS = ["clang-tidy", "clang-format", "g++"]
+# files that clang-tidy reads besides the source itself
+FORMAT_DEPS = (".h", ".hh", ".hpp", ".hxx", ".inc", ".def", ".clang-tidy")
+
+
+class TargetError(Exception):
+    pass
 
 
 def read_file(filename, raw=False):
@@ -34,41 +51,6 @@ def escaped_path(s: str):
     return s
 
 
-def unify_path(old_path):
-    abs_target_path = os.path.abspath(target_path)
-    abs_old_path = os.path.abspath(old_path)
-    if abs_old_path.startswith(abs_target_path):
-        return os.path.relpath(abs_old_path, abs_target_path)
-    else:
-        return old_path
-
-
-def configure():
-    global target_path
-    logging.info("configuring")
-    subprocess.run(["./rb-build", "config"],
-                   cwd=target_path, check=True,
-                   stdout=subprocess.DEVNULL)
-
-
-def build_clean():
-    global target_path
-    logging.info("cleaning")
-    subprocess.run(["./rb-build", "clean"],
-                   cwd=target_path, check=True,
-                   stdout=subprocess.DEVNULL)
-
-
-def get_binary_name():
-    global binary_name
-    global target_path
-    proc = subprocess.run(["./rb-build", "binary"],
-                          cwd=target_path, check=True,
-                          stdout=subprocess.PIPE)
-    binary_name = proc.stdout.decode()
-    binary_name = binary_name.rstrip('\n')
-
-
 def get_compile_dest(args):
     try:
         dash_o = args.index("-o")
@@ -88,182 +70,369 @@ def recognize_compiler(exe):
     return exe
 
 
-def find_link_from_bear(bear_out):
-
-    def is_link_target(execution):
-        global binary_name
-        exe = execution["executable"]
-        if recognize_compiler(exe) == exe:
-            return False
-        args = execution["arguments"]
-        workdir = execution["workingDir"]
-        name = get_compile_dest(args)
-        if name is None:
-            return False
-        if os.path.basename(name) != os.path.basename(binary_name):
-            return False
-        for i in range(1, len(args)):
-            arg = args[i]
-            if arg.startswith("-"):
-                continue
-            arg_path = os.path.join(workdir, arg)
-            if not os.path.exists(arg_path):
-                if args[i-1] != "-o" and args[i-1] != "-l":
-                    return False
-        return True
-
-    exec_pattern = r"execution: (.*)"
-    for match in re.finditer(exec_pattern, bear_out):
-        execution = json.loads(match.group(1))
-        if is_link_target(execution):
-            return execution
-    return None
-
-
-def parse_link_args(link_execution):
-    link_opts = []
-    target_objs = []
-    target_exe = None
-    dash_o = -1
-    workdir = link_execution["workingDir"]
-    for i, arg in enumerate(link_execution["arguments"]):
-        if i == 0:
-            continue
-        if arg == "-o":
-            dash_o = i
-            continue
-        if i == dash_o + 1:
-            arg_path = unify_path(os.path.join(workdir, arg))
-            target_exe = arg_path
-            continue
-        if arg.startswith("-"):
-            link_opts.append(arg)
+def cache_dir(*names):
+    root = os.environ.get("RACEBENCH_CACHE", os.path.expanduser("~/.cache/racebench"))
+    path = os.path.join(root, *names)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def formatter_path():
+    return os.path.join(os.path.dirname(__file__), "../format/formatter")
+
+
+@functools.lru_cache(maxsize=None)
+def format_tool_hash():
+    # formatted output also depends on the tool versions, the formatter script and the style file
+    h = hashlib.sha1()
+    for tool in FORMAT_TOOLS:
+        try:
+            version = subprocess.run([tool, "--version"], stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL).stdout
+        except FileNotFoundError:
+            version = b"missing"
+        h.update(tool.encode() + b"\0" + version)
+    format_dir = os.path.dirname(formatter_path())
+    for name in ["formatter", "_clang-format"]:
+        h.update(read_file(os.path.join(format_dir, name), raw=True))
+    return h.hexdigest()
+
+
+class Target:
+    def __init__(self, target_path, dest_path, cpu_slots=None):
+        self.target_path = target_path
+        self.dest_path = dest_path
+        self.binary_name = None
+        # shared by all targets of a batch to bound the number of running tools
+        self.cpu_slots = cpu_slots or threading.BoundedSemaphore(FORMAT_JOBS)
+        self.log = logging.getLogger(os.path.basename(os.path.normpath(dest_path)))
+        self.timings = dict()
+        self.exists_cache = dict()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.time() - start
+
+    def run_tool(self, cmd, **kwargs):
+        with self.cpu_slots:
+            return subprocess.run(cmd, **kwargs)
+
+    def unify_path(self, old_path):
+        abs_target_path = os.path.abspath(self.target_path)
+        abs_old_path = os.path.abspath(old_path)
+        if abs_old_path.startswith(abs_target_path):
+            return os.path.relpath(abs_old_path, abs_target_path)
         else:
-            arg_path = unify_path(os.path.join(workdir, arg))
-            target_objs.append(arg_path)
-    return link_opts, target_objs, target_exe
-
-
-def format_code(src_path):
-    global target_path
-    formatter = os.path.join(os.path.dirname(__file__), "../format/formatter")
-    proc = subprocess.run([formatter, src_path, target_path],
-                          check=True, stdout=subprocess.DEVNULL)
-
-
-def format_all_code(target_srcs):
-    global target_path
-    for src in target_srcs:
-        logging.info("formatting %s" % src)
-        src_path = os.path.join(target_path, src)
-        format_code(src_path)
-
-
-def target_build():
-    global target_path
-    global dest_path
-
-    logging.info("compiling")
-    compile_cmd_path = "compile_commands.json"
-    proc = subprocess.run(["bear", "--output", compile_cmd_path, "--verbose", "--",
-                           "sh", "-c", "./rb-build build 2>/dev/null"],
-                          cwd=target_path, check=True,
-                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
-    compile_cmd_path = os.path.join(target_path, compile_cmd_path)
-    compile_cmds = read_file(compile_cmd_path)
-    compile_cmds = json.loads(compile_cmds)
-
-    target_srcs = [unify_path(cmd["file"]) for cmd in compile_cmds]
-
-    bear_out = proc.stderr.decode("latin-1")
-    link_execution = find_link_from_bear(bear_out)
-    if link_execution is None:
-        logging.fatal("cannot find linker command line")
-        exit(1)
-    del link_execution["environment"]
-    print("link commands: %s" % link_execution)
-
-    format_all_code(target_srcs)
-    os.unlink(compile_cmd_path)
-
-    logging.info("generating makefile")
-    gen_makefile(link_execution)
-
-
-def gen_makefile(link_execution):
-    global dest_path
-    makefile_path = os.path.join(os.path.dirname(__file__), "sample-Makefile")
-    new_makefile_path = os.path.join(dest_path, "Makefile")
-    code = read_file(makefile_path)
-
-    linker = link_execution["executable"]
-    link_args = link_execution["arguments"][1:]
-    workdir = link_execution["workingDir"]
-    abs_workdir = os.path.abspath(workdir)
-    workdir = unify_path(workdir)
-
-    def convert_link_arg(arg):
-
-        def convert_path(path):
-            if os.path.isabs(path):
-                if not os.path.isabs(unify_path(path)):
-                    return os.path.relpath(path, abs_workdir)
-            return path
-
-        if arg.startswith("-"):
-            if arg[:2] in {"-I", "-L"}:
-                arg = arg[:2] + convert_path(arg[2:])
-        else:
-            arg = convert_path(arg)
-
-        return escaped_path(arg)
-
-    linker = recognize_compiler(linker)
-    link_args = [convert_link_arg(a) for a in link_args]
-    if linker == "$(CC)":
-        link_args.append("$(CFLAGS)")
-    if linker == "$(CXX)":
-        link_args.append("$(CXXFLAGS)")
-
-    defs = {"O_LINKER": linker,
-            "O_LINK_ARGS": ' '.join(link_args),
-            "O_WORKDIR": workdir}
-    for k, v in defs.items():
-        code = code.replace("{" + k + "}", str(v))
-    write_file(new_makefile_path, code)
-
+            return old_path
+
+    def configure(self):
+        self.log.info("configuring")
+        self.run_tool(["./rb-build", "config"],
+                      cwd=self.target_path, check=True,
+                      stdout=subprocess.DEVNULL)
+
+    def build_clean(self):
+        self.log.info("cleaning")
+        self.run_tool(["./rb-build", "clean"],
+                      cwd=self.target_path, check=True,
+                      stdout=subprocess.DEVNULL)
+
+    def get_binary_name(self):
+        proc = subprocess.run(["./rb-build", "binary"],
+                              cwd=self.target_path, check=True,
+                              stdout=subprocess.PIPE)
+        binary_name = proc.stdout.decode()
+        self.binary_name = binary_name.rstrip('\n')
+
+    def path_exists(self, path):
+        # link candidates of one build share most of their inputs
+        exists = self.exists_cache.get(path)
+        if exists is None:
+            exists = os.path.exists(path)
+            self.exists_cache[path] = exists
+        return exists
+
+    def find_link_from_bear(self, bear_out):
+        # bear_out yields the lines of bear's verbose log, possibly while it is running
+
+        def is_link_target(execution):
+            exe = execution["executable"]
+            if recognize_compiler(exe) == exe:
+                return False
+            args = execution["arguments"]
+            workdir = execution["workingDir"]
+            name = get_compile_dest(args)
+            if name is None:
+                return False
+            if os.path.basename(name) != os.path.basename(self.binary_name):
+                return False
+            for i in range(1, len(args)):
+                arg = args[i]
+                if arg.startswith("-"):
+                    continue
+                arg_path = os.path.join(workdir, arg)
+                if not self.path_exists(arg_path):
+                    if args[i-1] != "-o" and args[i-1] != "-l":
+                        return False
+            return True
+
+        exec_marker = b"execution: "
+        binary = os.path.basename(self.binary_name).encode("latin-1")
+        link_execution = None
+        for line in bear_out:
+            if link_execution is not None:
+                # keep draining so bear does not block on a full pipe
+                continue
+            pos = line.find(exec_marker)
+            if pos == -1 or binary not in line:
+                continue
+            execution = json.loads(line[pos + len(exec_marker):].decode("latin-1"))
+            if is_link_target(execution):
+                link_execution = execution
+        return link_execution
+
+    def run_bear(self, compile_cmd_path):
+        # bear 3.0.8 keeps only compilations in its output database, so the link
+        # command has to come from the verbose log, read as a stream
+        cmd = ["bear", "--output", compile_cmd_path, "--verbose", "--",
+               "sh", "-c", "./rb-build build 2>/dev/null"]
+        with self.cpu_slots:
+            proc = subprocess.Popen(cmd, cwd=self.target_path,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            with proc.stderr:
+                link_execution = self.find_link_from_bear(proc.stderr)
+            retcode = proc.wait()
+        if retcode != 0:
+            raise subprocess.CalledProcessError(retcode, cmd)
+        return link_execution
+
+    def parse_link_args(self, link_execution):
+        link_opts = []
+        target_objs = []
+        target_exe = None
+        dash_o = -1
+        workdir = link_execution["workingDir"]
+        for i, arg in enumerate(link_execution["arguments"]):
+            if i == 0:
+                continue
+            if arg == "-o":
+                dash_o = i
+                continue
+            if i == dash_o + 1:
+                arg_path = self.unify_path(os.path.join(workdir, arg))
+                target_exe = arg_path
+                continue
+            if arg.startswith("-"):
+                link_opts.append(arg)
+            else:
+                arg_path = self.unify_path(os.path.join(workdir, arg))
+                target_objs.append(arg_path)
+        return link_opts, target_objs, target_exe
+
+    def format_deps_hash(self):
+        # a header or .clang-tidy edit anywhere in the tree invalidates the whole target
+        h = hashlib.sha1()
+        for root, dirs, files in os.walk(self.target_path):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if not name.endswith(FORMAT_DEPS) or not os.path.isfile(path):
+                    continue
+                h.update(os.path.relpath(path, self.target_path).encode() + b"\0")
+                h.update(read_file(path, raw=True))
+        return h.hexdigest()
+
+    def format_key(self, src_path, compile_cmd, tool_hash):
+        abs_target_path = os.path.abspath(self.target_path)
+        args = compile_cmd.get("arguments") or [compile_cmd.get("command", "")]
+        args = [a.replace(abs_target_path, "") for a in args]
+        h = hashlib.sha1(tool_hash.encode())
+        h.update(json.dumps(args).encode())
+        h.update(read_file(src_path, raw=True))
+        return h.hexdigest()
+
+    def format_code(self, src_path):
+        self.run_tool([formatter_path(), src_path, self.target_path],
+                      check=True, stdout=subprocess.DEVNULL)
+
+    def format_code_cached(self, src, compile_cmd, tool_hash, blob_dir):
+        src_path = os.path.join(self.target_path, src)
+        key = self.format_key(src_path, compile_cmd, tool_hash)
+        blob_path = os.path.join(blob_dir, key)
+        if os.path.exists(blob_path):
+            self.log.info("formatting %s (cached)" % src)
+            copy(blob_path, src_path)
+            return
+        self.log.info("formatting %s" % src)
+        self.format_code(src_path)
+        tmp_path = "%s.%d.%d.tmp" % (blob_path, os.getpid(), threading.get_ident())
+        copy(src_path, tmp_path)
+        os.replace(tmp_path, blob_path)
+
+    def format_all_code(self, compile_cmds):
+        # a source can be compiled more than once, format it once
+        target_srcs = dict()
+        for cmd in compile_cmds:
+            target_srcs.setdefault(self.unify_path(cmd["file"]), cmd)
+        tool_hash = format_tool_hash() + self.format_deps_hash()
+        blob_dir = cache_dir("format")
+        with ThreadPoolExecutor(FORMAT_JOBS) as pool:
+            jobs = [pool.submit(self.format_code_cached, src, cmd, tool_hash, blob_dir)
+                    for src, cmd in target_srcs.items()]
+            for job in jobs:
+                job.result()
+
+    def target_build(self):
+        self.log.info("compiling")
+        compile_cmd_path = "compile_commands.json"
+        with self.stage("build"):
+            link_execution = self.run_bear(compile_cmd_path)
+        compile_cmd_path = os.path.join(self.target_path, compile_cmd_path)
+        compile_cmds = read_file(compile_cmd_path)
+        compile_cmds = json.loads(compile_cmds)
+
+        if link_execution is None:
+            raise TargetError("cannot find linker command line")
+        del link_execution["environment"]
+        self.log.info("link commands: %s" % link_execution)
+
+        with self.stage("format"):
+            self.format_all_code(compile_cmds)
+        os.unlink(compile_cmd_path)
+
+        self.log.info("generating makefile")
+        self.gen_makefile(link_execution)
+
+    def gen_makefile(self, link_execution):
+        makefile_path = os.path.join(os.path.dirname(__file__), "sample-Makefile")
+        new_makefile_path = os.path.join(self.dest_path, "Makefile")
+        code = read_file(makefile_path)
+
+        linker = link_execution["executable"]
+        link_args = link_execution["arguments"][1:]
+        workdir = link_execution["workingDir"]
+        abs_workdir = os.path.abspath(workdir)
+        workdir = self.unify_path(workdir)
+
+        def convert_link_arg(arg):
+
+            def convert_path(path):
+                if os.path.isabs(path):
+                    if not os.path.isabs(self.unify_path(path)):
+                        return os.path.relpath(path, abs_workdir)
+                return path
 
-def copy_target():
-    global dest_path
-    global target_path
-    logging.info("copying target")
-    new_target_path = os.path.join(dest_path, "src")
-    os.mkdir(dest_path)
-    copy(target_path, new_target_path, recursive=True)
-    target_path = new_target_path
+            if arg.startswith("-"):
+                if arg[:2] in {"-I", "-L"}:
+                    arg = arg[:2] + convert_path(arg[2:])
+            else:
+                arg = convert_path(arg)
+
+            return escaped_path(arg)
+
+        linker = recognize_compiler(linker)
+        link_args = [convert_link_arg(a) for a in link_args]
+        if linker == "$(CC)":
+            link_args.append("$(CFLAGS)")
+        if linker == "$(CXX)":
+            link_args.append("$(CXXFLAGS)")
+
+        defs = {"O_LINKER": linker,
+                "O_LINK_ARGS": ' '.join(link_args),
+                "O_WORKDIR": workdir}
+        for k, v in defs.items():
+            code = code.replace("{" + k + "}", str(v))
+        write_file(new_makefile_path, code)
+
+    def copy_target(self):
+        self.log.info("copying target")
+        new_target_path = os.path.join(self.dest_path, "src")
+        os.mkdir(self.dest_path)
+        copy(self.target_path, new_target_path, recursive=True)
+        self.target_path = new_target_path
+
+    def run(self):
+        if os.path.exists(self.dest_path):
+            raise TargetError("dest path %s already exists" % self.dest_path)
+
+        self.get_binary_name()
+
+        with self.stage("copy"):
+            self.copy_target()
+
+        with self.stage("config"):
+            self.configure()
+        self.target_build()
+        with self.stage("clean"):
+            self.build_clean()
+
+
+def run_target(target):
+    start = time.time()
+    # target_path points into dst once copied
+    result = {"src": target.target_path, "dst": target.dest_path}
+    try:
+        target.run()
+        result["status"] = "ok"
+    except Exception as e:
+        # one broken target must not stop the others
+        target.log.error("failed: %r" % e)
+        result["status"] = "failed"
+        result["error"] = repr(e)
+    result["time"] = time.time() - start
+    result["stages"] = target.timings
+    return result
+
+
+def run_batch(manifest_path, jobs, report_path=None):
+    # the manifest is a json list of {"src": ..., "dst": ...}
+    entries = json.loads(read_file(manifest_path))
+    cpu_slots = threading.BoundedSemaphore(FORMAT_JOBS)
+    targets = [Target(e["src"], e["dst"], cpu_slots) for e in entries]
+    with ThreadPoolExecutor(jobs) as pool:
+        results = list(pool.map(run_target, targets))
+
+    print("%-30s %-8s %10s  %s" % ("target", "status", "time(s)", "stages"))
+    for r in results:
+        stages = " ".join("%s=%.1f" % (k, v) for k, v in r["stages"].items())
+        print("%-30s %-8s %10.1f  %s" % (r["dst"], r["status"], r["time"], stages))
+        if "error" in r:
+            print("    %s" % r["error"])
+    failed = sum(1 for r in results if r["status"] != "ok")
+    print("%d targets, %d failed" % (len(results), failed))
+    if report_path is not None:
+        write_file(report_path, json.dumps(results, indent=4))
+    return failed == 0
 
 
 def main():
-    global target_path
-    global dest_path
-
-    if len(sys.argv) != 3:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("src", nargs="?")
+    parser.add_argument("dst", nargs="?")
+    parser.add_argument("--batch", metavar="MANIFEST", help="json list of {\"src\", \"dst\"} targets")
+    parser.add_argument("--jobs", type=int, default=FORMAT_JOBS, help="targets onboarded at once")
+    parser.add_argument("--report", help="write per-target results as json")
+    args = parser.parse_args()
+
+    if args.batch is not None:
+        if not run_batch(args.batch, args.jobs, args.report):
+            exit(1)
+        return
+
+    if args.src is None or args.dst is None:
         print("Usage: %s <src> <dst>" % sys.argv[0])
+        print("       %s --batch <manifest> [--jobs N] [--report FILE]" % sys.argv[0])
         exit(1)
-    target_path = sys.argv[1]
-    dest_path = sys.argv[2]
-    if os.path.exists(dest_path):
-        print("dest path %s already exists" % dest_path)
+    try:
+        Target(args.src, args.dst).run()
+    except TargetError as e:
+        logging.fatal(str(e))
         exit(1)
 
-    get_binary_name()
-
-    copy_target()
-
-    configure()
-    target_build()
-    build_clean()
-
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
@@ -0,0 +1,242 @@
+from typing import Callable, Dict, List, Optional
+import numpy
+
+from bug import Bug, BugExecWrap
+from compiler import SlotTable
+from executor import InterleaveExec
+from general import Interleave
+from piece import *
+
+
+Lanes = numpy.ndarray
+ExprFunc = Callable[[Lanes], numpy.ndarray]
+PieceFunc = Callable[[Lanes], None]
+
+
+class BatchExecutor:
+    # Run code pieces on many lanes at once, one lane per input.
+    # The state is a (lanes x vars) uint32 array, and each lane has its own
+    # skip level and trigger flag. A lane that breaks a lock stops there,
+    # like a LockError stops the sequential executors.
+
+    def __init__(self, inputs: List[bytes]):
+        self.lanes = len(inputs)
+        self.table = SlotTable()
+        self.values = numpy.zeros((self.lanes, 0), dtype=numpy.uint32)
+        self.skip_level = numpy.zeros(self.lanes, dtype=numpy.int32)
+        self.trigger = numpy.zeros(self.lanes, dtype=bool)
+        self.alive = numpy.ones(self.lanes, dtype=bool)
+        self.input_size = numpy.array([len(x) for x in inputs], dtype=numpy.int64)
+        width = max(1, int(self.input_size.max())) if self.lanes > 0 else 1
+        self.input_data = numpy.zeros((self.lanes, width), dtype=numpy.uint32)
+        for lane, x in enumerate(inputs):
+            self.input_data[lane, :len(x)] = numpy.frombuffer(bytes(x), dtype=numpy.uint8)
+        self.compiled: Dict[CodePiece, PieceFunc] = dict()
+
+    def slot(self, name: str) -> int:
+        index = self.table.slot(name)
+        if index >= self.values.shape[1]:
+            grow = numpy.full((self.lanes, len(self.table) - self.values.shape[1]), DefaultValue, dtype=numpy.uint32)
+            self.values = numpy.concatenate([self.values, grow], axis=1)
+        return index
+
+    def get_var(self, name: str) -> numpy.ndarray:
+        index = self.table.slots.get(name)
+        if index is None:
+            return numpy.full(self.lanes, DefaultValue, dtype=numpy.uint32)
+        return self.values[:, index]
+
+    def input_value(self, index: int, fall_back: numpy.ndarray, lanes: Lanes) -> numpy.ndarray:
+        if index >= self.input_data.shape[1]:
+            return fall_back
+        return numpy.where(index < self.input_size[lanes], self.input_data[lanes, index], fall_back)
+
+    def run(self, code: CodePiece):
+        lanes = numpy.nonzero(self.alive)[0]
+        if len(lanes) == 0:
+            return
+        func = self.compiled.get(code)
+        if func is None:
+            func = self.compile_piece(code)
+            self.compiled[code] = func
+        func(lanes)
+
+    def active(self, lanes: Lanes) -> Lanes:
+        return lanes[self.skip_level[lanes] == 0]
+
+    def compile_arg(self, arg) -> ExprFunc:
+        if isinstance(arg, str):
+            slot = self.slot(arg)
+            return lambda lanes: self.values[lanes, slot]
+        if isinstance(arg, Expression):
+            return self.compile_expr(arg)
+        if isinstance(arg, InputValue):
+            index = arg.index
+            fall_back = numpy.uint32(arg.fall_back)
+            return lambda lanes: self.input_value(index, numpy.full(len(lanes), fall_back, dtype=numpy.uint32), lanes)
+        if isinstance(arg, TVal):
+            value = numpy.uint32(arg)
+            return lambda lanes: numpy.full(len(lanes), value, dtype=numpy.uint32)
+        raise ValueError("expr arg", arg)
+
+    def compile_expr(self, expr: Expression) -> ExprFunc:
+        op = expr.op
+        args = [self.compile_arg(arg) for arg in expr.args]
+        n = len(args)
+        u32 = numpy.uint32
+        if op == "+":
+            def run(lanes):
+                ans = args[0](lanes)
+                for f in args[1:]:
+                    ans = ans + f(lanes)
+                return ans
+            return run
+        elif op == "^":
+            def run(lanes):
+                ans = args[0](lanes)
+                for f in args[1:]:
+                    ans = ans ^ f(lanes)
+                return ans
+            return run
+        elif op == "-":
+            if n == 1:
+                a, = args
+                return lambda lanes: u32(0) - a(lanes)
+            elif n == 2:
+                a, b = args
+                return lambda lanes: a(lanes) - b(lanes)
+        elif op == "!":
+            if n == 1:
+                a, = args
+                return lambda lanes: (a(lanes) == 0).astype(u32)
+        elif op == "==":
+            if n == 2:
+                a, b = args
+                return lambda lanes: (a(lanes) == b(lanes)).astype(u32)
+        elif op == "!=":
+            if n == 2:
+                a, b = args
+                return lambda lanes: (a(lanes) != b(lanes)).astype(u32)
+        elif op == "&&":
+            if n == 2:
+                a, b = args
+                return lambda lanes: ((a(lanes) != 0) & (b(lanes) != 0)).astype(u32)
+        elif op == "?:":
+            if n == 3:
+                a, b, c = args
+                return lambda lanes: numpy.where(a(lanes) != 0, b(lanes), c(lanes))
+        raise NotImplementedError
+
+    def compile_piece(self, code: CodePiece) -> PieceFunc:
+        if isinstance(code, BlockEnd):
+            def run(lanes):
+                level = self.skip_level[lanes]
+                self.skip_level[lanes] = numpy.maximum(level - 1, 0)
+            return run
+
+        if isinstance(code, IfCond):
+            cond = self.compile_expr(code.cond)
+
+            def run(lanes):
+                active = self.active(lanes)
+                skipped = lanes[self.skip_level[lanes] != 0]
+                self.skip_level[skipped] += 1
+                if len(active) > 0:
+                    false = active[cond(active) == 0]
+                    self.skip_level[false] += 1
+            return run
+
+        if isinstance(code, Assign):
+            return self.compile_assign(code)
+
+        if isinstance(code, LockOp):
+            slot = self.slot(code.name)
+            old, new = (0, 1) if code.require else (1, 0)
+
+            def run(lanes):
+                active = self.active(lanes)
+                bad = self.values[active, slot] != old
+                self.alive[active[bad]] = False
+                self.values[active[~bad], slot] = new
+            return run
+
+        if isinstance(code, Crash):
+            def run(lanes):
+                self.trigger[self.active(lanes)] = True
+            return run
+
+        if isinstance(code, (Sleep, IfdefBug, IfdefEnd)):
+            return lambda lanes: None
+
+        def run(lanes):
+            if len(self.active(lanes)) > 0:
+                raise NotImplementedError("exec", code)
+        return run
+
+    def compile_assign(self, code: Assign) -> PieceFunc:
+        slot = self.slot(code.var)
+        if isinstance(code, AssignImm):
+            imm = numpy.uint32(code.imm)
+            value = lambda lanes: imm
+        elif isinstance(code, AssignVar):
+            rslot = self.slot(code.rvar)
+            value = lambda lanes: self.values[lanes, rslot]
+        elif isinstance(code, AssignInput):
+            index = code.index
+            value = lambda lanes: self.input_value(index, self.values[lanes, slot], lanes)
+        elif isinstance(code, AssignExpr):
+            value = self.compile_expr(code.expr)
+        elif isinstance(code, AssignControl):
+            cond = self.compile_expr(code.cond)
+            rslot = self.slot(code.rvar)
+            value = lambda lanes: numpy.where(cond(lanes) != 0, self.values[lanes, rslot], self.values[lanes, slot])
+        else:
+            raise NotImplementedError("exec assign", code)
+
+        def run(lanes):
+            active = self.active(lanes)
+            if len(active) > 0:
+                self.values[active, slot] = value(active)
+        return run
+
+    def triggered(self) -> numpy.ndarray:
+        # the real program aborts at the crash, a later lock error does not matter
+        return self.trigger.copy()
+
+    def locked(self) -> numpy.ndarray:
+        return ~self.alive
+
+
+class PieceRecorder:
+    # stands in for an executor to list the pieces an order runs
+    def __init__(self):
+        self.pieces: List[CodePiece] = []
+
+    def run(self, code: CodePiece):
+        self.pieces.append(code)
+
+
+class BatchChecker:
+    def __init__(self, bug: Bug):
+        self.bug = bug
+
+    def record(self, order: Interleave) -> List[CodePiece]:
+        # the pieces only depend on the order, skipping is up to the executor
+        recorder = PieceRecorder()
+        ex_rec = BugExecWrap(self.bug, recorder)
+        ix_rec = InterleaveExec(order, ex_rec.execute, ex_rec.max_code_ptr)
+        while ix_rec.next():
+            pass
+        return recorder.pieces
+
+    def execute(self, inputs: List[bytes], order: Optional[Interleave] = None) -> BatchExecutor:
+        if order is None:
+            order = self.bug.order
+        executor = BatchExecutor(inputs)
+        for code in self.record(order):
+            executor.run(code)
+        return executor
+
+    def run_inputs(self, inputs: List[bytes], order: Optional[Interleave] = None) -> numpy.ndarray:
+        # one order, one lane per input: which inputs trigger the bug
+        return self.execute(inputs, order).triggered()
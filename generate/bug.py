@@ -1,10 +1,11 @@
 from __future__ import annotations
 import random
-from typing import Callable, Dict, List, Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from general import *
 from executor import CodePieceExecutor
 from piece import BlockEnd, IfCond, IfdefBug, IfdefEnd
+from rle import write_rle
 from tracer import ThreadPos, Trace
 from variable import Variable
 
@@ -14,18 +15,28 @@ class Bug:
         self.bug_id = bug_id
         self.input_file = input_file
         self.sites: Dict[FileLine, CodeSite] = dict()
+        self.site_events: Dict[FileLine, Optional[ThreadPos]] = dict()
         self.log = BugLog()
         self.order = Interleave()
         self.all_vars: List[Variable] = list()
 
     def get_code(self, loc: FileLine) -> List[CodeLazy]:
-        if loc not in self.sites:
+        site = self.sites.get(loc)
+        if site is None:
             return []
-        return self.sites[loc].get_code()
+        return site.get_code()
+
+    def get_edit_vars(self, loc: FileLine) -> Set[str]:
+        site = self.sites.get(loc)
+        if site is None:
+            return set()
+        return site.edit_vars
 
-    def get_site(self, loc: FileLine) -> CodeSite:
+    def get_site(self, loc: FileLine, event: Optional[ThreadPos] = None) -> CodeSite:
         if loc not in self.sites:
             self.sites[loc] = CodeSite(loc)
+            # the trace event the site was first seen at
+            self.site_events[loc] = event
         return self.sites[loc]
 
     def append_code(self, loc: FileLine, code: CodeReserve) -> CodeLazy:
@@ -56,10 +67,13 @@ class Bug:
     def iter_code_sites(self):
         return self.sites.items()
 
-    def dump_order(self, file_name: str):
+    def dump_order(self, file_name: str, rle: bool = False):
         with open(file_name, "w", encoding='latin-1') as f:
-            for tp in self.order:
-                f.write(tp.str_new_line() + '\n')
+            if rle:
+                write_rle(f, ((self.order.str_new_line(i), n) for i, n in self.order.runs()))
+                return
+            for i in range(len(self.order)):
+                f.write(self.order.str_new_line(i) + '\n')
 
 
 class BugLog:
@@ -88,6 +102,13 @@ class BugLog:
             "locations": locs,
         })
 
+    def add_simulation(self, trigger_rate: float):
+        # kept in bug-N.json, to compare with the native easy check later
+        self.items.append({
+            "type": "simulate",
+            "trigger_rate": trigger_rate,
+        })
+
     def add_assume(self, name: str):
         self.items.append({
             "type": "assume",
@@ -115,7 +136,7 @@ class TraceWalker:
             if tpos.file_line is None:
                 exloc = None
             else:
-                site = self.bug.get_site(tpos.file_line)
+                site = self.bug.get_site(tpos.file_line, tpos)
                 if tpos.line_loc == LineLoc.Middle:
                     exloc = site.exloc_middle()
                 else:
@@ -139,10 +160,14 @@ class TraceWalker:
                 continue
             pos = self._thread_pos(tnum)
             if pos and pos.line_loc == LineLoc.Before:
-                site = self.bug.get_site(pos.file_line)
+                site = self.bug.get_site(pos.file_line, pos)
                 tpos.append(ThreadPointer(tnum, site.exloc_current()))
         return tpos
 
+    def at_site_event(self, tnum: int, index: int, loc: FileLine) -> bool:
+        # thread tnum is at the trace event that loc's site was first seen at
+        return self.trace.thread_pos(tnum, index) is self.bug.site_events.get(loc)
+
     def get_available_pos_at(self, index: int) -> List[Tuple[int, FileLine]]:
         if index >= len(self.trace):
             return []
@@ -175,6 +200,7 @@ class BugExecWrap:
         self.bug = bug
         self.executor = executor
         self.generate = False
+        self.first_deferred: Optional[int] = None
 
     def set_generate(self, generate: bool):
         self.generate = generate
@@ -187,6 +213,8 @@ class BugExecWrap:
             if order_index < code.after_order:
                 # skip generation and don't run any code
                 # but we still need to change the skip level
+                if self.first_deferred is None:
+                    self.first_deferred = order_index
                 if code.base == IfCond:
                     self.executor.inc_skip_level()
                 elif code.base == BlockEnd:
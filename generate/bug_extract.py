@@ -1,15 +1,20 @@
-from typing import Callable
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
 import sys
 import random
+import threading
 
 from bug import *
 from codegen import CodeGenerator
-from executor import CheckerExecutor, CodePieceExecutor, InterleaveExec
+from executor import InterleaveExec, ReplaySnapshots
+from compiler import CompiledCheckerExecutor
 from pattern import BugPattern, PatternGenerator, StepMarker
 from tracer import Trace
 from piece import *
 from general import *
 from dom import DomAnalyzer
+from simulate import ScheduleSimulator
 from error import *
 from utils import read_file
 
@@ -115,7 +120,7 @@ class BugExtractState:
                     impl_type = random.choices(list(Assume.ImplType), weights)[0]
                     next_bug = self.expand_assume(code, marker, impl_type)
                 else:
-                    site = self.bug.get_site(marker.file_line)
+                    site = self.bug.get_site(marker.file_line, marker.event)
                     code_lazy = self.bug.append_code(marker.file_line, code)
                     order_index = self.bug.append_order(ThreadPointer(marker.tid, site.exloc_current()))
                     # set when to generate pre_cond
@@ -142,7 +147,7 @@ class BugExtractState:
         next_bug = False
         self.bug.log.add_assume(impl_type.name)
         loc = marker.file_line
-        site = self.bug.get_site(loc)
+        site = self.bug.get_site(loc, marker.event)
         if impl_type == Assume.ImplType.Crash:
             self.bug.append_code(loc, Reserved(IfCond, cond))
             self.bug.append_code(loc, Reserved(Crash, self.bug.bug_id))
@@ -164,51 +169,111 @@ class BugExtractState:
         self.bug.append_ifdef_end()
         self.bug.add_vars(self.code_gen.list_all_vars())
 
-        cp_runner = CodePieceExecutor(self.input_bytes)
-        ex0 = BugExecWrap(self.bug, cp_runner)
-        ex0.set_generate(True)
-        ix0 = InterleaveExec(self.bug.order, ex0.execute, ex0.max_code_ptr)
-        while ix0.next():
-            if cp_runner.state.should_skip():
-                raise CantFollowOrder
-
-        checker = CheckerExecutor(self.input_bytes)
+        # generate the code while checking, the two runs only differ after
+        # the first code whose generation is deferred
+        checker = CompiledCheckerExecutor(self.input_bytes)
         ex_chk = BugExecWrap(self.bug, checker)
+        ex_chk.set_generate(True)
         ix_chk = InterleaveExec(self.bug.order, ex_chk.execute, ex_chk.max_code_ptr)
-        while ix_chk.next():
+        snapshots = ReplaySnapshots(ix_chk, checker)
+        while True:
+            if ex_chk.first_deferred is None:
+                snapshots.take()
+            if not ix_chk.next():
+                break
             if checker.state.should_skip():
                 raise CantFollowOrder
+
+        if ex_chk.first_deferred is not None:
+            snapshots.restore_before(ex_chk.first_deferred)
+            ex_chk.set_generate(False)
+            while ix_chk.next():
+                if checker.state.should_skip():
+                    raise CantFollowOrder
         if not checker.has_triggered():
             raise BugCantTrigger
 
+    def check_simulated_trigger(self):
+        # reject bugs that trigger in most random schedules before building them
+        simulator = ScheduleSimulator(self.bug, self.input_bytes, self.trace.thread_step_rates())
+        if simulator.is_too_easy():
+            raise BugTooEasy
+
 
 class BugExtractor:
     FAIL_LIMIT = 20
+    CANDIDATE_NUM = 4
 
     def __init__(self, loc_checker: Callable[[FileLine], bool], dom: DomAnalyzer,
-                 bug_checker: Callable[[Bug], None]):
+                 bug_checker: Callable[[Bug, threading.Event], None],
+                 candidate_num: int = CANDIDATE_NUM, check_jobs: int = 1):
         self.loc_checker = loc_checker
         self.dom = dom
+        # bug_checker raises CheckCancelled soon after the event is set
         self.bug_checker = bug_checker
+        self.candidate_num = candidate_num
+        self.check_jobs = check_jobs
+        self.fail_count: Counter = Counter()
+
+    def _fail(self, e: BugError):
+        print("retry", type(e).__name__)
+        self.fail_count[type(e).__name__] += 1
+        if sum(self.fail_count.values()) >= self.FAIL_LIMIT:
+            print("failures", dict(self.fail_count))
+            raise e
+
+    def _check_bug(self, state: BugExtractState, stop: threading.Event) -> BugExtractState:
+        if stop.is_set():
+            raise CheckCancelled
+        self.bug_checker(state.bug, stop)
+        return state
 
     def extract(self, bug_id: int, trace: Trace, input_file: str, path_len: int) -> Bug:
 
         def loc_checker_with_trace(fileline: FileLine) -> bool:
             return self.loc_checker(fileline) and not trace.in_blacklist(fileline)
 
-        fail_count = 0
+        self.fail_count.clear()
         while True:
-            sys.stdout.flush()
-            state = BugExtractState(bug_id, trace, self.dom, loc_checker_with_trace, input_file)
-            try:
-                state.add_bug(path_len)
-                state.implement()
-                self.bug_checker(state.bug)
-            except BugError as e:
-                print("retry", type(e).__name__)
-                fail_count += 1
-                if fail_count >= self.FAIL_LIMIT:
-                    raise e
-                continue
-            break
-        return state.bug
+            # candidates are cheap to generate, but expensive to check
+            candidates: List[BugExtractState] = []
+            while len(candidates) < self.candidate_num:
+                sys.stdout.flush()
+                state = BugExtractState(bug_id, trace, self.dom, loc_checker_with_trace, input_file)
+                try:
+                    state.add_bug(path_len)
+                    state.implement()
+                    state.check_simulated_trigger()
+                except BugError as e:
+                    self._fail(e)
+                    continue
+                candidates.append(state)
+                if sum(self.fail_count.values()) + len(candidates) >= self.FAIL_LIMIT:
+                    break
+
+            accepted: Optional[BugExtractState] = None
+            errors: List[BugError] = []
+            stop = threading.Event()
+            with ThreadPoolExecutor(max_workers=min(len(candidates), self.check_jobs)) as pool:
+                futures = [pool.submit(self._check_bug, state, stop) for state in candidates]
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    try:
+                        state = future.result()
+                    except CheckCancelled:
+                        continue
+                    except BugError as e:
+                        errors.append(e)
+                        continue
+                    if accepted is None:
+                        # the first passing candidate wins, the running checks are killed
+                        accepted = state
+                        stop.set()
+                        for f in futures:
+                            f.cancel()
+            if accepted is not None:
+                print("failures", dict(self.fail_count))
+                return accepted.bug
+            for e in errors:
+                self._fail(e)
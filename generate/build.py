@@ -1,6 +1,7 @@
 from typing import Dict, Optional
 import os
 import subprocess
+import threading
 from utils import *
 
 
@@ -8,7 +9,8 @@ class Builder:
     def __init__(self, path: str):
         self.path = path
 
-    def exec(self, arg: str, env: Optional[Dict[str, str]] = None, dump_cmd: bool = False):
+    def exec(self, arg: str, env: Optional[Dict[str, str]] = None, dump_cmd: bool = False,
+             stop: Optional[threading.Event] = None):
         cmd = ["make"]
         if arg != "":
             cmd.append(arg)
@@ -18,26 +20,28 @@ class Builder:
                 new_env[k] = v
         if dump_cmd:
             cmd = ["bear", "--"] + cmd
-        subprocess.run(cmd, cwd=self.path, env=new_env,
-                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        run_checked(cmd, stop, cwd=self.path, env=new_env,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-    def clean(self):
-        self.exec("clean")
+    def clean(self, stop: Optional[threading.Event] = None):
+        self.exec("clean", stop=stop)
 
-    def compile(self, debug_info: bool = False, dump_cmd: bool = False):
+    def compile(self, debug_info: bool = False, dump_cmd: bool = False,
+                stop: Optional[threading.Event] = None):
         if debug_info:
             env = {"CFLAGS": "-g", "CXXFLAGS": "-g", "LDFLAGS": "-g"}
         else:
             env = {}
-        self.exec("", env, dump_cmd)
+        self.exec("", env, dump_cmd, stop)
 
-    def install(self):
-        self.exec("install")
+    def install(self, stop: Optional[threading.Event] = None):
+        self.exec("install", stop=stop)
 
-    def rebuild_and_install(self, debug_info: bool = False, dump_cmd: bool = False):
-        self.clean()
-        self.compile(debug_info, dump_cmd)
-        self.install()
+    def rebuild_and_install(self, debug_info: bool = False, dump_cmd: bool = False,
+                            stop: Optional[threading.Event] = None):
+        self.clean(stop)
+        self.compile(debug_info, dump_cmd, stop)
+        self.install(stop)
 
     def clean_compile_db(self):
         compile_db = os.path.join(self.path, "compile_commands.json")
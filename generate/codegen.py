@@ -1,17 +1,20 @@
 from __future__ import annotations
 from typing import Any, ByteString, Callable, Dict, List, Optional, Tuple
+import heapq
+import math
 import random
-import numpy
 
 from piece import *
 from error import *
 from general import *
 from variable import *
+from uint32 import u32
 
 
 class VarData:
-    def __init__(self, var: Variable, editable: bool, use_count: int = 0):
+    def __init__(self, var: Variable, index: int, editable: bool, use_count: int = 0):
         self.var = var
+        self.index = index
         self.editable = editable
         self.use_count = use_count
 
@@ -21,6 +24,10 @@ class VarData:
     def is_normal(self):
         return self.var.type == VarType.Normal
 
+    def pool_key(self) -> Tuple[int, int, str]:
+        # least used first, then oldest first
+        return self.use_count, self.index, self.name
+
     @property
     def name(self):
         return self.var.name
@@ -37,42 +44,65 @@ class CodeGenerator:
         self.input_bytes = input_bytes
         self.all_vars: Dict[str, VarData] = dict()
         self.count = 0
+        # heaps of normal vars and editable normal vars by pool_key
+        # an entry is stale if the var has been used or changed since
+        self.normal_pool: List[Tuple[int, int, str]] = []
+        self.edit_pool: List[Tuple[int, int, str]] = []
+        self.editable_count = 0
 
     def list_all_vars(self) -> List[Variable]:
         return list(v.var for v in self.all_vars.values())
 
+    def _add_to_pools(self, v: VarData):
+        if not v.is_normal():
+            return
+        heapq.heappush(self.normal_pool, v.pool_key())
+        if v.editable:
+            heapq.heappush(self.edit_pool, v.pool_key())
+
+    def _pool_top(self, need_edit: bool) -> Optional[VarData]:
+        pool = self.edit_pool if need_edit else self.normal_pool
+        while len(pool) > 0:
+            use_count, _, name = pool[0]
+            v = self.all_vars[name]
+            if v.use_count == use_count and (v.editable or not need_edit):
+                return v
+            heapq.heappop(pool)
+        return None
+
     def new_var(self, var_type: VarType = VarType.Normal, editable: bool = False) -> str:
         v = Variable(var_type, self.bug_id, str(self.count))
+        data = VarData(v, self.count, editable)
         self.count += 1
-        self.all_vars[v.name] = VarData(v, editable)
+        self.all_vars[v.name] = data
+        if editable:
+            self.editable_count += 1
+        self._add_to_pools(data)
         return v.name
 
     def old_var(self, need_edit: bool) -> str:
-        def var_filter(v: VarData) -> bool:
-            if not v.is_normal():
-                return False
-            if need_edit and not v.editable:
-                return False
-            return True
-        usable_vars = list(filter(var_filter, self.all_vars.values()))
-        if len(usable_vars) == 0:
+        var = self._pool_top(need_edit)
+        if var is None:
             var = self.new_var(editable=need_edit)
             var = self.all_vars[var]
-        else:
-            var = min(usable_vars, key=lambda v: v.use_count)
         var.increase_use()
+        self._add_to_pools(var)
         return var.name
 
     def count_editable_vars(self) -> int:
-        count = 0
-        for v in self.all_vars.values():
-            if v.editable:
-                count += 1
-        return count
+        return self.editable_count
 
     def set_editable(self, var_name: str, editable: bool):
         v = self.all_vars[var_name]
+        if v.editable == editable:
+            return
         v.editable = editable
+        if editable:
+            self.editable_count += 1
+            if v.is_normal():
+                heapq.heappush(self.edit_pool, v.pool_key())
+        else:
+            self.editable_count -= 1
 
     def new_assign(self, var_name: str, use_vars: Optional[List[str]] = None) -> CodeReserve:
         if use_vars is None:
@@ -83,7 +113,7 @@ class CodeGenerator:
             (0, self._new_assign_input),
             (1, self._new_assign_var),
             (2, self._new_assign_control),
-            (numpy.inf, self._new_assign_expr),
+            (math.inf, self._new_assign_expr),
         ]
         methods: List[Callable[[List[str]], Any]] = []
         for n_use, method in assign_methods:
@@ -129,7 +159,7 @@ class CodeGenerator:
 
     @staticmethod
     def random_value() -> TVal:
-        return TVal(random.getrandbits(32))
+        return u32(random.getrandbits(32))
 
     def _new_assign_imm(self, use_vars: List[str]) -> TVal:
         imm = self.random_value()
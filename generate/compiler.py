@@ -0,0 +1,246 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from functools import reduce
+import operator
+
+from general import State
+from executor import CodePieceExecutor, eval_input
+from piece import *
+from error import *
+from uint32 import Mask, u32
+
+ExprFunc = Callable[[List[int]], int]
+PieceFunc = Callable[["CompiledExecutor"], None]
+
+
+class SlotTable:
+    def __init__(self):
+        self.slots: Dict[str, int] = dict()
+
+    def slot(self, name: str) -> int:
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+
+class SlotState(State):
+    def __init__(self, table: SlotTable):
+        super().__init__()
+        self.table = table
+        self.slots: List[int] = []
+
+    def ensure(self):
+        if len(self.slots) < len(self.table):
+            self.slots.extend([DefaultValue] * (len(self.table) - len(self.slots)))
+
+    def get_var(self, name: str):
+        index = self.table.slots.get(name)
+        if index is None or index >= len(self.slots):
+            return DefaultValue
+        return self.slots[index]
+
+    def set_var(self, name: str, value: TVal):
+        index = self.table.slot(name)
+        self.ensure()
+        self.slots[index] = u32(value)
+
+    def snapshot(self) -> Tuple[List[int], int]:
+        return list(self.slots), self.skip_level
+
+    def restore(self, snapshot: Tuple[List[int], int]):
+        slots, self.skip_level = snapshot
+        self.slots = list(slots)
+
+
+def _const(value: int) -> ExprFunc:
+    return lambda _: value
+
+
+class PieceCompiler:
+    # Compile code pieces into closures over a slot-indexed state.
+    # The closures must behave exactly like CodePieceExecutor.run.
+
+    def __init__(self, input_bytes: bytes):
+        self.input_bytes = input_bytes
+        self.table = SlotTable()
+        self.compiled: Dict[CodePiece, PieceFunc] = dict()
+
+    def get(self, code: CodePiece) -> PieceFunc:
+        func = self.compiled.get(code)
+        if func is None:
+            func = self.compile_piece(code)
+            self.compiled[code] = func
+        return func
+
+    def compile_arg(self, arg) -> ExprFunc:
+        if isinstance(arg, str):
+            return operator.itemgetter(self.table.slot(arg))
+        if isinstance(arg, Expression):
+            return self.compile_expr(arg)
+        if isinstance(arg, InputValue):
+            return _const(eval_input(self.input_bytes, arg))
+        if isinstance(arg, TVal):
+            return _const(u32(arg))
+        raise ValueError("expr arg", arg)
+
+    def compile_expr(self, expr: Expression) -> ExprFunc:
+        op = expr.op
+        args = [self.compile_arg(arg) for arg in expr.args]
+        n = len(args)
+        if op == "+":
+            if n == 2:
+                a, b = args
+                return lambda v: (a(v) + b(v)) & Mask
+            return lambda v: sum(f(v) for f in args) & Mask
+        elif op == "^":
+            if n == 2:
+                a, b = args
+                return lambda v: a(v) ^ b(v)
+            return lambda v: reduce(operator.xor, (f(v) for f in args))
+        elif op == "-":
+            if n == 1:
+                a, = args
+                return lambda v: -a(v) & Mask
+            elif n == 2:
+                a, b = args
+                return lambda v: (a(v) - b(v)) & Mask
+        elif op == "!":
+            if n == 1:
+                a, = args
+                return lambda v: int(a(v) == 0)
+        elif op == "==":
+            if n == 2:
+                a, b = args
+                return lambda v: int(a(v) == b(v))
+        elif op == "!=":
+            if n == 2:
+                a, b = args
+                return lambda v: int(a(v) != b(v))
+        elif op == "&&":
+            if n == 2:
+                a, b = args
+                return lambda v: int(bool(a(v)) and bool(b(v)))
+        elif op == "?:":
+            if n == 3:
+                a, b, c = args
+                return lambda v: b(v) if a(v) else c(v)
+        raise NotImplementedError
+
+    def compile_piece(self, code: CodePiece) -> PieceFunc:
+        if isinstance(code, BlockEnd):
+            def run(ex: CompiledExecutor):
+                ex.state.dec_skip_level()
+            return run
+
+        if isinstance(code, IfCond):
+            cond = self.compile_expr(code.cond)
+
+            def run(ex: CompiledExecutor):
+                state = ex.state
+                if state.skip_level >= 1 or not cond(state.slots):
+                    state.skip_level += 1
+            return run
+
+        if isinstance(code, Assign):
+            return self.compile_assign(code)
+
+        if isinstance(code, LockOp):
+            slot = self.table.slot(code.name)
+            old, new = (0, 1) if code.require else (1, 0)
+
+            def run(ex: CompiledExecutor):
+                state = ex.state
+                if state.skip_level >= 1:
+                    return
+                if state.slots[slot] != old:
+                    raise LockError
+                state.slots[slot] = new
+            return run
+
+        if isinstance(code, Crash):
+            def run(ex: CompiledExecutor):
+                if ex.state.skip_level < 1:
+                    ex.crash()
+            return run
+
+        if isinstance(code, (Sleep, IfdefBug, IfdefEnd)):
+            def run(ex: CompiledExecutor):
+                pass
+            return run
+
+        def run(ex: CompiledExecutor):
+            if ex.state.skip_level < 1:
+                raise NotImplementedError("exec", code)
+        return run
+
+    def compile_assign(self, code: Assign) -> PieceFunc:
+        slot = self.table.slot(code.var)
+        if isinstance(code, AssignImm):
+            imm = u32(code.imm)
+            value = lambda v: imm
+        elif isinstance(code, AssignVar):
+            value = operator.itemgetter(self.table.slot(code.rvar))
+        elif isinstance(code, AssignInput):
+            if code.index >= len(self.input_bytes):
+                # keep the old value
+                value = operator.itemgetter(slot)
+            else:
+                value = _const(self.input_bytes[code.index])
+        elif isinstance(code, AssignExpr):
+            value = self.compile_expr(code.expr)
+        elif isinstance(code, AssignControl):
+            cond = self.compile_expr(code.cond)
+            rvar = operator.itemgetter(self.table.slot(code.rvar))
+            old = operator.itemgetter(slot)
+            value = lambda v: rvar(v) if cond(v) else old(v)
+        else:
+            raise NotImplementedError("exec assign", code)
+
+        def run(ex: CompiledExecutor):
+            state = ex.state
+            if state.skip_level >= 1:
+                return
+            slots = state.slots
+            slots[slot] = value(slots)
+        return run
+
+
+class CompiledExecutor(CodePieceExecutor):
+    def __init__(self, input_bytes: bytes, compiler: Optional[PieceCompiler] = None):
+        super().__init__(input_bytes)
+        if compiler is None:
+            compiler = PieceCompiler(input_bytes)
+        self.compiler = compiler
+        self.state = SlotState(compiler.table)
+
+    def run(self, code: CodePiece):
+        func = self.compiler.compiled.get(code)
+        if func is None:
+            func = self.compiler.get(code)
+        if len(self.state.slots) < len(self.compiler.table.slots):
+            self.state.ensure()
+        func(self)
+
+    def crash(self):
+        pass
+
+
+class CompiledCheckerExecutor(CompiledExecutor):
+    def __init__(self, input_bytes: bytes, compiler: Optional[PieceCompiler] = None):
+        super().__init__(input_bytes, compiler)
+        self.trigger = False
+
+    def crash(self):
+        self.trigger = True
+
+    def has_triggered(self):
+        return self.trigger
+
+    def snapshot(self) -> Any:
+        return super().snapshot(), self.trigger
+
+    def restore(self, snapshot: Any):
+        state, self.trigger = snapshot
+        super().restore(state)
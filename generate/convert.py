@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
+import threading
 import json
 import tempfile
 import subprocess
 import os
 
 from utils import *
+from rle import plain_file
 
 
 class Converter:
@@ -18,7 +20,8 @@ class Converter:
     def _tempfile(self):
         return tempfile.NamedTemporaryFile(mode="w", suffix=".convert.json", delete=False)
 
-    def run(self, log_path: str, out_path: str):
+    def run(self, log_path: str, out_path: str, output_log: Optional[str] = None,
+            stop: Optional[threading.Event] = None):
         exe_path = os.path.join(os.path.dirname(__file__), "..", "gdb_trace", "convert.py")
         config = {
             "cmd": self.cmd,
@@ -29,10 +32,13 @@ class Converter:
             "log": log_path,
             "output": out_path,
         }
-        with self._tempfile() as f:
-            config_file = f.name
-            json.dump(config, f)
-        subprocess.run(["python3", exe_path, config_file], check=True,
-                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        remove_file(config_file)
+        with plain_file(log_path) as plain_log:
+            config["log"] = plain_log
+            with self._tempfile() as f:
+                config_file = f.name
+                json.dump(config, f)
+            with open_log(output_log) as out:
+                run_checked(["python3", exe_path, config_file], stop,
+                            stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT)
+            remove_file(config_file)
         assert os.path.isfile(out_path) and not is_empty_file(out_path)
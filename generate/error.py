@@ -30,5 +30,13 @@ class CantReproduce(BugError):
     pass
 
 
+class CantConvert(BugError):
+    pass
+
+
 class LockError(BugError):
     pass
+
+
+class CheckCancelled(BugError):
+    pass
@@ -1,44 +1,15 @@
-from typing import Any, Callable, List, Optional
-import numpy
-from functools import reduce
-import operator
+from typing import Any, Callable, List, Optional, Tuple
+import bisect
 
-from general import LocBeforeLine, FileLine, Interleave, State, ThreadPointer
+from uint32 import eval_op
+from general import CodeSite, FileLine, Interleave, State
 from piece import *
 from error import *
 
 
-def eval_op(op: str, args: List[TVal]) -> TVal:
-    if op == "+":
-        return numpy.sum(args, dtype=TVal)
-    elif op == "^":
-        return reduce(operator.xor, args)
-    elif op == "-":
-        if len(args) == 1:
-            return -args[0]
-        elif len(args) == 2:
-            return args[0] - args[1]
-    elif op == "!":
-        if len(args) == 1:
-            return TVal(args[0] == 0)
-    elif op == "==":
-        if len(args) == 2:
-            return TVal(args[0] == args[1])
-    elif op == "!=":
-        if len(args) == 2:
-            return TVal(args[0] != args[1])
-    elif op == "&&":
-        if len(args) == 2:
-            return TVal(bool(args[0]) and bool(args[1]))
-    elif op == "?:":
-        if len(args) == 3:
-            return args[1] if args[0] else args[2]
-    raise NotImplementedError
-
-
 def eval_input(input_bytes: bytes, iv: InputValue) -> TVal:
     if iv.index < len(input_bytes):
-        return TVal(input_bytes[iv.index])
+        return input_bytes[iv.index]
     else:
         return iv.fall_back
 
@@ -51,45 +22,60 @@ class InterleaveExec:
         self.execute = execute
         self.max_code_ptr = max_code_ptr
         self.num_threads = self.interleave.num_threads()
-        self.threads = [ThreadPointer(tid, None) for tid in range(self.num_threads)]
+        # where each thread is, read straight from the interleave arrays
+        self.thread_sites: List[Optional[CodeSite]] = [None] * self.num_threads
+        self.thread_ptrs = [Interleave.NoCodePtr] * self.num_threads
         self.cur_index = 0
 
     def next(self) -> bool:
-        if self.cur_index >= len(self.interleave):
+        index = self.cur_index
+        order = self.interleave
+        if index >= len(order.tids):
             return False
-        tp = self.interleave[self.cur_index]
         self.cur_index += 1
-        old_loc = self.threads[tp.tid]
-        self._move_exec(old_loc.location, tp.location)
-        self.threads[tp.tid] = tp
+        tid = order.tids[index]
+        site = order.sites[index]
+        code_ptr = order.code_ptrs[index]
+        self._move_exec(self.thread_sites[tid], self.thread_ptrs[tid], site, code_ptr)
+        self.thread_sites[tid] = site
+        self.thread_ptrs[tid] = code_ptr
         return True
 
-    def _move_exec(self, old_loc: Optional[LocBeforeLine], new_loc: Optional[LocBeforeLine]):
-        if old_loc is None:
+    def _move_exec(self, old_site: Optional[CodeSite], old_ptr: int,
+                   new_site: Optional[CodeSite], new_ptr: int):
+        if old_site is None:
             return
-        old_ptr = old_loc.code_ptr
-        if old_ptr is None:
-            old_ptr = self.max_code_ptr(old_loc.file_line)
-        if new_loc is None:
-            self.exec_range(old_loc.file_line, old_ptr, self.max_code_ptr(old_loc.file_line))
+        old_line = old_site.file_line
+        if old_ptr == Interleave.NoCodePtr:
+            old_ptr = self.max_code_ptr(old_line)
+        if new_site is None:
+            self.exec_range(old_line, old_ptr, self.max_code_ptr(old_line))
             return
-        new_ptr = new_loc.code_ptr
-        if new_ptr is None:
-            new_ptr = self.max_code_ptr(new_loc.file_line)
+        new_line = new_site.file_line
+        if new_ptr == Interleave.NoCodePtr:
+            new_ptr = self.max_code_ptr(new_line)
         if new_ptr == 0:
-            self.exec_range(old_loc.file_line, old_ptr, self.max_code_ptr(old_loc.file_line))
+            self.exec_range(old_line, old_ptr, self.max_code_ptr(old_line))
         else:
-            if not (old_loc.file_line == new_loc.file_line):
-                self.exec_range(old_loc.file_line, old_ptr, self.max_code_ptr(old_loc.file_line))
-                self.exec_range(new_loc.file_line, 0, new_ptr)
+            if not (old_line == new_line):
+                self.exec_range(old_line, old_ptr, self.max_code_ptr(old_line))
+                self.exec_range(new_line, 0, new_ptr)
             else:
-                self.exec_range(new_loc.file_line, old_ptr, new_ptr)
+                self.exec_range(new_line, old_ptr, new_ptr)
 
     def exec_range(self, file_line: FileLine, old_code_ptr: int, new_code_ptr: int):
         assert old_code_ptr <= new_code_ptr
         for ptr in range(old_code_ptr, new_code_ptr):
             self.execute(self.cur_index - 1, file_line, ptr)
 
+    def snapshot(self) -> Tuple[int, List[Optional[CodeSite]], List[int]]:
+        return self.cur_index, list(self.thread_sites), list(self.thread_ptrs)
+
+    def restore(self, snapshot: Tuple[int, List[Optional[CodeSite]], List[int]]):
+        self.cur_index, sites, ptrs = snapshot
+        self.thread_sites = list(sites)
+        self.thread_ptrs = list(ptrs)
+
 
 class CodePieceExecutor:
     def __init__(self, input_bytes: bytes):
@@ -124,6 +110,12 @@ class CodePieceExecutor:
     def should_skip(self) -> bool:
         return self.state.should_skip()
 
+    def snapshot(self) -> Any:
+        return self.state.snapshot()
+
+    def restore(self, snapshot: Any):
+        self.state.restore(snapshot)
+
     def run(self, code: CodePiece):
         if isinstance(code, BlockEnd):
             self.dec_skip_level()
@@ -196,3 +188,40 @@ class CheckerExecutor(CodePieceExecutor):
 
     def has_triggered(self):
         return self.trigger
+
+    def snapshot(self) -> Any:
+        return super().snapshot(), self.trigger
+
+    def restore(self, snapshot: Any):
+        state, self.trigger = snapshot
+        super().restore(state)
+
+
+class ReplaySnapshots:
+    # Snapshots of an interleave replay, so it can resume from an order index.
+    Interval = 64
+
+    def __init__(self, ix: InterleaveExec, executor: CodePieceExecutor, interval: int = Interval):
+        self.ix = ix
+        self.executor = executor
+        self.interval = interval
+        self.indexes: List[int] = []
+        self.snapshots: List[Tuple[Any, Any]] = []
+
+    def take(self):
+        index = self.ix.cur_index
+        if len(self.indexes) > 0 and index - self.indexes[-1] < self.interval:
+            return
+        self.indexes.append(index)
+        self.snapshots.append((self.ix.snapshot(), self.executor.snapshot()))
+
+    def restore_before(self, index: int) -> int:
+        # resume from the last snapshot taken before running order[index]
+        pos = bisect.bisect_right(self.indexes, index) - 1
+        assert pos >= 0
+        ix_snapshot, ex_snapshot = self.snapshots[pos]
+        self.ix.restore(ix_snapshot)
+        self.executor.restore(ex_snapshot)
+        del self.indexes[pos + 1:]
+        del self.snapshots[pos + 1:]
+        return self.indexes[pos]
@@ -1,22 +1,48 @@
 from __future__ import annotations
+from array import array
 from enum import Enum
-from typing import Callable, Dict, List, Optional, Set, Type
+import itertools
+import weakref
+from typing import Dict, FrozenSet, Iterator, List, Optional, Set, Tuple, Type
 from piece import CodePiece, DefaultValue, Expression, TVal
 from utils import *
 
 
 class FileLine:
-    def __init__(self, filename: str, line: int):
-        self.filename = filename
-        self.line = line
+    # interned: equal locations share one object and id while any of them is alive,
+    # the weak table lets locations of finished targets go
+    __slots__ = ("filename", "line", "id", "_hash", "__weakref__")
+    _table: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+    _next_id = itertools.count()
+
+    filename: str
+    line: int
+    id: int
+
+    def __new__(cls, filename: str, line: int):
+        key = (filename, line)
+        obj = FileLine._table.get(key)
+        if obj is None:
+            obj = object.__new__(cls)
+            obj.filename = filename
+            obj.line = line
+            obj.id = next(FileLine._next_id)
+            obj._hash = hash(key)
+            obj = FileLine._table.setdefault(key, obj)
+        return obj
+
+    def __reduce__(self):
+        return FileLine, (self.filename, self.line)
 
     def extend_path(self, cwd: str) -> FileLine:
         return FileLine(extend_path(self.filename, cwd), self.line)
 
     def __hash__(self) -> int:
-        return hash(self.filename) ^ self.line
+        return self._hash
 
     def __eq__(self, other: FileLine) -> bool:
+        if self is other:
+            return True
         return self.filename == other.filename and self.line == other.line
 
 
@@ -27,6 +53,8 @@ class LineLoc(Enum):
 
 
 class LocBeforeLine:
+    __slots__ = ("site", "code_ptr", "new_line")
+
     def __init__(self, site: CodeSite, code_ptr: Optional[int]):
         self.site = site
         self.code_ptr = code_ptr
@@ -49,12 +77,11 @@ class LocBeforeLine:
 
 
 class CodeSite:
-    result_line_getter: Callable[[Optional[int]], int]
-
     def __init__(self, fline: FileLine):
         self.file_line = fline
         self.code_list: List[CodeLazy] = []
-        self.result_line_getter = lambda _: 0
+        self.edit_vars: Set[str] = set()
+        self.insertion: Optional[InsertionPoint] = None
 
     @property
     def filename(self):
@@ -66,6 +93,7 @@ class CodeSite:
 
     def append_code(self, code: CodeLazy):
         self.code_list.append(code)
+        self.edit_vars.update(code.reserved.edit_vars())
 
     def exloc_current(self) -> LocBeforeLine:
         return LocBeforeLine(self, len(self.code_list))
@@ -79,14 +107,16 @@ class CodeSite:
     def get_code(self) -> List[CodeLazy]:
         return self.code_list
 
-    def set_result_line_getter(self, getter: Callable[[Optional[int]], int]):
-        self.result_line_getter = getter
+    def set_insertion(self, ins_point: InsertionPoint):
+        self.insertion = ins_point
 
-    def get_result_line(self, index: Optional[int]):
-        return self.result_line_getter(index)
+    def get_result_line(self, index: int) -> int:
+        return self.insertion.get_result_line(index)
 
 
 class ThreadPointer:
+    __slots__ = ("tid", "location", "line_loc")
+
     def __init__(self, tid: int, loc: Optional[LocBeforeLine], line_loc: LineLoc = LineLoc.Before):
         self.tid = tid
         self.location = loc
@@ -115,6 +145,8 @@ class ThreadPointer:
 
 
 class CodeLazy:
+    __slots__ = ("reserved", "code", "after_order")
+
     def __init__(self, rcode: CodeReserve):
         self.reserved = rcode
         self.code: Optional[CodePiece] = None
@@ -152,6 +184,13 @@ class State:
     def should_skip(self):
         return self.skip_level >= 1
 
+    def snapshot(self) -> Tuple[Dict[str, TVal], int]:
+        return dict(self.values), self.skip_level
+
+    def restore(self, snapshot: Tuple[Dict[str, TVal], int]):
+        values, self.skip_level = snapshot
+        self.values = dict(values)
+
 
 class FutureVal:
     def __call__(self, state: State) -> TVal:
@@ -169,15 +208,22 @@ class ExpectedVar(FutureVal):
 class CodeReserve:
     def __init__(self, base: Type[CodePiece]):
         self.base = base
+        self._used_vars: Optional[FrozenSet[str]] = None
+        self._edit_vars: Optional[FrozenSet[str]] = None
 
     def generate(self, state: State) -> CodePiece:
         raise NotImplementedError
 
-    def used_vars(self) -> Set[str]:
-        return self.generate(State()).used_vars()
+    # variables do not depend on the state, so generate once and cache them
+    def used_vars(self) -> FrozenSet[str]:
+        if self._used_vars is None:
+            self._used_vars = frozenset(self.generate(State()).used_vars())
+        return self._used_vars
 
-    def edit_vars(self) -> Set[str]:
-        return self.generate(State()).edit_vars()
+    def edit_vars(self) -> FrozenSet[str]:
+        if self._edit_vars is None:
+            self._edit_vars = frozenset(self.generate(State()).edit_vars())
+        return self._edit_vars
 
     @staticmethod
     def convert(x, state: State):
@@ -212,22 +258,87 @@ class ReservedExpr(CodeReserve):
 
 
 class Interleave:
+    # one entry per step, kept as parallel arrays instead of ThreadPointer objects
+    NoCodePtr = -1
+    NoNewLine = -1
+
     def __init__(self):
-        self.data: List[ThreadPointer] = list()
+        self.tids = array("i")
+        self.sites: List[Optional[CodeSite]] = list()
+        self.code_ptrs = array("i")
+        self.line_locs: List[LineLoc] = list()
+        self.new_lines = array("i")
 
     def __len__(self):
-        return len(self.data)
+        return len(self.tids)
 
-    def __getitem__(self, idx):
-        return self.data[idx]
+    def __getitem__(self, idx) -> ThreadPointer:
+        site = self.sites[idx]
+        if site is None:
+            loc = None
+        else:
+            code_ptr = self.code_ptrs[idx]
+            loc = LocBeforeLine(site, None if code_ptr == Interleave.NoCodePtr else code_ptr)
+            new_line = self.new_lines[idx]
+            if new_line != Interleave.NoNewLine:
+                loc.set_new_line(new_line)
+        return ThreadPointer(self.tids[idx], loc, self.line_locs[idx])
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
 
     def append(self, item: ThreadPointer) -> int:
-        index = len(self.data)
-        self.data.append(item)
+        index = len(self.tids)
+        loc = item.location
+        self.tids.append(item.tid)
+        self.line_locs.append(item.line_loc)
+        if loc is None:
+            self.sites.append(None)
+            self.code_ptrs.append(Interleave.NoCodePtr)
+            self.new_lines.append(Interleave.NoNewLine)
+        else:
+            self.sites.append(loc.site)
+            self.code_ptrs.append(Interleave.NoCodePtr if loc.code_ptr is None else loc.code_ptr)
+            self.new_lines.append(Interleave.NoNewLine if loc.new_line is None else loc.new_line)
         return index
 
+    def append_step(self, other: Interleave, idx: int) -> int:
+        # copy one entry of another interleave without building a ThreadPointer
+        index = len(self.tids)
+        self.tids.append(other.tids[idx])
+        self.sites.append(other.sites[idx])
+        self.code_ptrs.append(other.code_ptrs[idx])
+        self.line_locs.append(other.line_locs[idx])
+        self.new_lines.append(other.new_lines[idx])
+        return index
+
+    def set_new_line(self, idx: int, new_line: int):
+        self.new_lines[idx] = new_line
+
+    def str_new_line(self, idx: int) -> str:
+        site = self.sites[idx]
+        if site is None:
+            file_line = None
+        else:
+            file_line = "%s:%d" % (site.filename, self.new_lines[idx])
+        return "%d %s %s" % (self.tids[idx], self.line_locs[idx].value, file_line)
+
+    def runs(self) -> Iterator[Tuple[int, int]]:
+        # (first index, count) of consecutive identical entries
+        start = 0
+        for idx in range(1, len(self.tids) + 1):
+            if idx < len(self.tids) and self.tids[idx] == self.tids[start] \
+                    and self.sites[idx] is self.sites[start] \
+                    and self.code_ptrs[idx] == self.code_ptrs[start] \
+                    and self.line_locs[idx] == self.line_locs[start] \
+                    and self.new_lines[idx] == self.new_lines[start]:
+                continue
+            yield start, idx - start
+            start = idx
+
     def num_threads(self):
-        return 1 + max(tp.tid for tp in self.data)
+        return 1 + max(self.tids)
 
 
 class InjectLocation:
@@ -270,28 +381,3 @@ class InsertionPoint:
     @property
     def code_len(self):
         return len(self.codes)
-
-
-class AccInsertionPoint:
-    def __init__(self):
-        self.points: Dict[FileLine, List[InsertionPoint]] = dict()
-
-    def add_insertion_point(self, ins_point: InsertionPoint) -> Callable[[Optional[int]], int]:
-        file_line = ins_point.loc.file_loc
-        if file_line not in self.points:
-            point_list = []
-            self.points[file_line] = point_list
-        else:
-            point_list = self.points[file_line]
-        point_list.append(ins_point)
-        return self.result_line_getter(point_list, len(point_list) - 1)
-
-    def result_line_getter(self, point_list: List[InsertionPoint], pt_index: int) -> Callable[[Optional[int]], int]:
-        ins_point = point_list[pt_index]
-
-        def get_result_line(index: Optional[int]) -> int:
-            if index is None:
-                last_ins_point = point_list[-1]
-                return last_ins_point.get_result_line(last_ins_point.code_len)
-            return ins_point.get_result_line(index)
-        return get_result_line
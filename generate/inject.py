@@ -1,10 +1,18 @@
 from __future__ import annotations
-from typing import Dict, List
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, List, Optional, Tuple
+import hashlib
+import io
+import json
 import os
 import re
+import shutil
+import struct
+import tempfile
 
 from general import *
-from utils import write_file
+from utils import cache_dir, write_file, write_file_atomic
 
 
 BadExtensions = {".h", ".hpp", ".hxx"}
@@ -20,28 +28,53 @@ class InjectChecker:
     PatternBlock = re.compile(r"\{|\}")
     PatternLable = re.compile(r"\b(case)?\s*\w+:")
     PatternJump = re.compile(r"\b(break|continue|goto|return|longjmp)\b")
+    # bump when is_good_line changes, so stale bitmaps are not reused
+    CacheVersion = b"1"
 
-    def __init__(self, blacklist: List[str]):
+    def __init__(self, blacklist: List[str], cache_path: Optional[str] = None):
         self.blacklist = set(blacklist)
-        self.line_cache = dict()
+        self.cache_path = cache_path
+        self.file_ids: Dict[str, int] = dict()
+        # per file id, one byte per line, or None if nothing can be inserted
+        self.bitmaps: List[Optional[bytes]] = []
 
-    def build_cache(self, filename: str):
-        with open(filename, "r", encoding='latin-1') as f:
-            lines = f.readlines()
-        line_good = [self.is_good_line(line) for line in lines]
-        self.line_cache[filename] = line_good
+    def file_id(self, filename: str) -> int:
+        filename = os.path.abspath(filename)
+        fid = self.file_ids.get(filename)
+        if fid is None:
+            fid = len(self.bitmaps)
+            self.bitmaps.append(self.build_bitmap(filename))
+            self.file_ids[filename] = fid
+        return fid
+
+    def can_insert_at(self, file_id: int, line: int) -> bool:
+        bitmap = self.bitmaps[file_id]
+        if bitmap is None:
+            return False
+        return line == 0 or line > len(bitmap) or bitmap[line - 1] != 0
 
     def can_insert_before(self, filename: str, line: int) -> bool:
+        return self.can_insert_at(self.file_id(filename), line)
+
+    def build_bitmap(self, filename: str) -> Optional[bytes]:
         ext = os.path.splitext(filename)[1]
         if ext in BadExtensions:
-            return False
-        filename = os.path.abspath(filename)
+            return None
         if os.path.basename(filename) in self.blacklist:
-            return False
-        if filename not in self.line_cache:
-            self.build_cache(filename)
-        cache = self.line_cache[filename]
-        return line == 0 or line > len(cache) or cache[line - 1]
+            return None
+        with open(filename, "rb") as f:
+            content = f.read()
+        if self.cache_path is None:
+            self.cache_path = cache_dir("inject")
+        key = hashlib.sha1(InjectChecker.CacheVersion + content).hexdigest()
+        cache_file = os.path.join(self.cache_path, key)
+        if os.path.isfile(cache_file):
+            with open(cache_file, "rb") as f:
+                return unpack_bits(f.read())
+        lines = io.StringIO(content.decode("latin-1"), newline=None).readlines()
+        bitmap = bytes(self.is_good_line(line) for line in lines)
+        write_file_atomic(cache_file, pack_bits(bitmap))
+        return bitmap
 
     @staticmethod
     def is_good_line(line: str) -> bool:
@@ -59,25 +92,100 @@ class InjectChecker:
         return True
 
 
-class CodeAccumulator:
-    def __init__(self):
-        self.lines: List[str] = []
+def pack_bits(bitmap: bytes) -> bytes:
+    packed = bytearray((len(bitmap) + 7) // 8)
+    for i, bit in enumerate(bitmap):
+        if bit:
+            packed[i >> 3] |= 1 << (i & 7)
+    return struct.pack("<I", len(bitmap)) + bytes(packed)
+
+
+def unpack_bits(data: bytes) -> bytes:
+    count, = struct.unpack_from("<I", data)
+    packed = data[4:]
+    return bytes((packed[i >> 3] >> (i & 7)) & 1 for i in range(count))
+
+
+class CodeWriter:
+    def __init__(self, out: IO):
+        self.out = out
+        self.line_count = 0
 
     def add_code_line(self, line: str) -> int:
-        lineno = self.current_line()
-        self.lines.append(line)
-        return lineno
+        if self.line_count > 0:
+            self.out.write("\n")
+        self.out.write(line)
+        self.line_count += 1
+        return self.line_count
 
     def current_line(self) -> int:
-        return len(self.lines) + 1
+        return self.line_count + 1
+
 
-    def to_str(self) -> str:
-        return "\n".join(self.lines)
+class LineRemap:
+    # For each file, the original lines that got code inserted before them,
+    # and how many lines were inserted up to and including each of them.
+    def __init__(self):
+        self.tables: Dict[str, Tuple[List[int], List[int]]] = dict()
+
+    def add_file(self, filename: str, insertion: List[InsertionPoint]):
+        lines: List[int] = []
+        offsets: List[int] = []
+        offset = 0
+        for ins in insertion:
+            if ins.code_len == 0:
+                continue
+            offset += ins.code_len
+            if lines and lines[-1] == ins.loc.line:
+                offsets[-1] = offset
+            else:
+                lines.append(ins.loc.line)
+                offsets.append(offset)
+        self.tables[filename] = (lines, offsets)
+
+    def has_file(self, filename: str) -> bool:
+        return os.path.normpath(filename) in self.tables
+
+    def map_line(self, filename: str, line: int) -> int:
+        # keys are normalized, trace paths may look like ./x.c or a/../x.c
+        filename = os.path.normpath(filename)
+        if filename not in self.tables:
+            return line
+        lines, offsets = self.tables[filename]
+        i = bisect_right(lines, line)
+        return line if i == 0 else line + offsets[i - 1]
+
+    def map(self, file_line: FileLine) -> FileLine:
+        return FileLine(file_line.filename, self.map_line(file_line.filename, file_line.line))
+
+    def relative_to(self, root: str) -> LineRemap:
+        remap = LineRemap()
+        for filename, table in self.tables.items():
+            remap.tables[os.path.normpath(os.path.relpath(filename, root))] = table
+        return remap
+
+    def dump(self, path: str):
+        data = {name: list(zip(*table)) for name, table in self.tables.items()}
+        write_file(path, json.dumps(data))
+
+    @staticmethod
+    def load(path: str) -> LineRemap:
+        remap = LineRemap()
+        with open(path) as f:
+            data = json.load(f)
+        for name, pairs in data.items():
+            lines = [p[0] for p in pairs]
+            offsets = [p[1] for p in pairs]
+            remap.tables[os.path.normpath(name)] = (lines, offsets)
+        return remap
 
 
 class Injector:
+    ParallelFiles = 8
+
     def __init__(self):
         self.ops: Dict[str, List[InsertionPoint]] = dict()
+        self.line_remap = LineRemap()
 
     def add(self, loc: InjectLocation, codes: List[str]) -> InsertionPoint:
         filename = os.path.abspath(loc.filename)
@@ -87,38 +195,52 @@ class Injector:
         self.ops[filename].append(ins_point)
         return ins_point
 
-    def commit(self):
-        for filename, insertion in self.ops.items():
-            with open(filename, "r", encoding='latin-1') as f:
-                raw_lines = f.readlines()
-
-            insertion = insertion[:]
-            for lineno, code in enumerate(raw_lines):
-                lineno += 1
-                code = code.rstrip("\r\n")
-                loc = InjectLocation(FileLine(filename, lineno), LineLoc.Middle)
-                insertion.append(InsertionPoint(loc, [code]))
-            insertion.sort(key=lambda x: (x.loc.line, x.loc.line_loc.value))
-
-            acc = CodeAccumulator()
-            last_lineno = -1
-            indent = ""
-
-            for ins in insertion:
-                lineno = ins.loc.line
-                if lineno != last_lineno:
-                    last_lineno = lineno
-                    raw_line = raw_lines[lineno - 1] if lineno >= 1 else ""
-                    indent = indent_of_line(raw_line)
-
-                for i in range(ins.code_len):
-                    code = ins.get_code(i)
-                    if ins.loc.line_loc != LineLoc.Middle:
-                        code = indent + code
-                    new_lineno = acc.add_code_line(code)
-                    ins.set_result_line(i, new_lineno)
-                ins.set_result_line(ins.code_len, acc.current_line())
-
-            write_file(filename, acc.to_str())
-
+    def commit(self) -> LineRemap:
+        ops = list(self.ops.items())
+        if len(ops) >= Injector.ParallelFiles:
+            with ThreadPoolExecutor() as pool:
+                list(pool.map(lambda op: self._commit_file(*op), ops))
+        else:
+            for filename, insertion in ops:
+                self._commit_file(filename, insertion)
         self.ops.clear()
+        return self.line_remap
+
+    def _commit_file(self, filename: str, insertion: List[InsertionPoint]):
+        insertion = sorted(insertion, key=lambda x: (x.loc.line, x.loc.line_loc.value))
+        self.line_remap.add_file(filename, insertion)
+
+        out = tempfile.NamedTemporaryFile(
+            "w", encoding='latin-1', dir=os.path.dirname(filename), delete=False)
+        try:
+            with open(filename, "r", encoding='latin-1') as f, out:
+                writer = CodeWriter(out)
+                pos = 0
+                lineno = 0
+                for raw_line in f:
+                    lineno += 1
+                    pos = self._write_insertions(writer, insertion, pos, lineno, raw_line)
+                    writer.add_code_line(raw_line.rstrip("\r\n"))
+                # insertions past the end of file
+                last_line = insertion[-1].loc.line if insertion else 0
+                self._write_insertions(writer, insertion, pos, last_line, "")
+            shutil.copymode(filename, out.name)
+            os.replace(out.name, filename)
+        except BaseException:
+            os.unlink(out.name)
+            raise
+
+    @staticmethod
+    def _write_insertions(writer: CodeWriter, insertion: List[InsertionPoint], pos: int,
+                          lineno: int, raw_line: str) -> int:
+        # write insertions up to lineno, which all go before the original line
+        indent = indent_of_line(raw_line)
+        while pos < len(insertion) and insertion[pos].loc.line <= lineno:
+            ins = insertion[pos]
+            ins_indent = indent if ins.loc.line == lineno else ""
+            for i in range(ins.code_len):
+                new_lineno = writer.add_code_line(ins_indent + ins.get_code(i))
+                ins.set_result_line(i, new_lineno)
+            ins.set_result_line(ins.code_len, writer.current_line())
+            pos += 1
+        return pos
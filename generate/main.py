@@ -1,6 +1,5 @@
 import sys
 import json
-import numpy
 
 from utils import *
 from target import TargetProgram
@@ -14,6 +13,8 @@ class Config:
         self.mutate_num = content["mutate_num"]
         self.path_len = content["path_len"]
         self.bug_num = content["bug_num"]
+        self.trace_margin = content.get("trace_margin", 0)
+        self.rle_orders = content.get("rle_orders", False)
 
 
 def main():
@@ -22,7 +23,8 @@ def main():
     config_path = sys.argv[3]
     config = Config(config_path)
 
-    target = TargetProgram(origin, target_root, config.mutate_num)
+    target = TargetProgram(origin, target_root, config.mutate_num, config.trace_margin,
+                           config.rle_orders)
     target.build_debug()
     for i in range(config.bug_num):
         print("new bug %d" % i)
@@ -48,6 +50,4 @@ if __name__ == "__main__":
         print("Usage: %s origin target config" % sys.argv[0])
         sys.exit()
 
-    numpy.seterr(over="ignore", under="ignore")
-
     main()
@@ -3,7 +3,7 @@ from enum import Enum
 from functools import partial
 from itertools import chain
 import random
-from typing import Callable, List, Set, Tuple, Type
+from typing import Callable, List, Optional, Set, Tuple, Type
 from bug import *
 from dom import DomAnalyzer, DomMode
 from codegen import CodeGenerator
@@ -215,7 +215,7 @@ class OrderViolation(BasePattern):
             tmp = self.gen.new_var(editable=False)
             cvar = self.gen.new_var(editable=False)
             cond = Reserved(IfCond, ReservedExpr("!=", [cvar, DefaultValue]))
-            c1 = Reserved(AssignImm, cvar, TVal(DefaultValue + 1))
+            c1 = Reserved(AssignImm, cvar, DefaultValue + 1)
             v1 = self.gen.new_assign_many(tmp, MIN_ASSIGN_LEN)
             v1.append(Reserved(AssignVar, var, tmp))
             ck = Reserved(Assume, ReservedExpr("==", [var, tmp]))
@@ -265,10 +265,12 @@ class OrderViolation(BasePattern):
 
 
 class StepMarker:
-    def __init__(self, step: int, tid: int, file_line: FileLine):
+    def __init__(self, step: int, tid: int, file_line: FileLine, event: Optional[ThreadPos] = None):
         self.step = step
         self.tid = tid
         self.file_line = file_line
+        # trace event of the location, for a site that does not exist yet
+        self.event = event
 
 
 class PatternGenerator:
@@ -322,10 +324,10 @@ class PatternGenerator:
                 continue
 
             keep0 = keep1 = False
-            for _tid, pos in walker.get_available_pos_at(cur_index):
-                if pos is locs0[-1].file_line:
+            for tid, _pos in walker.get_available_pos_at(cur_index):
+                if walker.at_site_event(tid, cur_index, locs0[-1].file_line):
                     keep0 = True
-                if pos is locs1[-1].file_line:
+                if walker.at_site_event(tid, cur_index, locs1[-1].file_line):
                     keep1 = True
             if not keep1:
                 if not keep0:
@@ -337,10 +339,9 @@ class PatternGenerator:
             pos = tpos.file_line
             if pos == locs1[-1].file_line:
                 break
-            exist_code = self.bug.get_code(tpos.file_line)
-            if any(avoid_vars & code.reserved.edit_vars() for code in exist_code):
+            if not avoid_vars.isdisjoint(self.bug.get_edit_vars(tpos.file_line)):
                 break
-            next_locs.append(StepMarker(step, tpos.tid, pos))
+            next_locs.append(StepMarker(step, tpos.tid, pos, tpos))
 
         first_loc = locs0[0].file_line
         good_lines = self.dom.query(first_loc.filename, first_loc.line, pattern.dom_mode)
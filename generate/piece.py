@@ -1,13 +1,12 @@
 from __future__ import annotations
 from enum import Enum
 from typing import List, Set, Union
-import numpy
+from uint32 import TVal, c_literal
 
 
 BUG_MACRO = "RACEBENCH_BUG_{bug_id}"
 
-TVal = numpy.uint32
-DefaultValue = TVal(0)
+DefaultValue: TVal = 0
 
 
 class CodePiece:
@@ -98,8 +97,7 @@ class AssignImm(Assign):
         self.imm = imm
 
     def __str__(self) -> str:
-        mask = (1 << 32) - 1
-        return "%s = %s;" % (self.var, hex(self.imm & mask))
+        return "%s = %s;" % (self.var, c_literal(self.imm))
 
     def used_vars(self) -> Set[str]:
         return {self.var}
@@ -136,7 +134,7 @@ class InputValue(CodePiece):
         self.fall_back = fall_back
 
     def __str__(self) -> str:
-        return "{index} < rb_input_size ? (uint32_t)rb_input[{index}] : {fall_back}".format(index=self.index, fall_back=hex(self.fall_back))
+        return "{index} < rb_input_size ? (uint32_t)rb_input[{index}] : {fall_back}".format(index=self.index, fall_back=c_literal(self.fall_back))
 
     def used_vars(self) -> Set[str]:
         return set()
@@ -154,7 +152,7 @@ class Expression(CodePiece):
     def __str__(self) -> str:
         def to_str(x):
             if isinstance(x, TVal):
-                return hex(x)
+                return c_literal(x)
             if isinstance(x, str):
                 return x
             return str(x)
@@ -1,4 +1,5 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
+import json
 import os
 from bug import Bug
 from general import FileLine
@@ -7,7 +8,7 @@ from utils import *
 from inject import Injector
 from variable import *
 from general import *
-from piece import BUG_MACRO
+from piece import BUG_MACRO, IfCond
 
 
 PRESET_FILES = [
@@ -20,6 +21,9 @@ STATE_INSTANCE = "racebench_bugs.c"
 
 PREPEND_DEFS = ["#include \"%s\"" % STATE_DEFINE]
 
+REACH_MAP = "racebench_reach.json"
+REACH_CALL = "RB_REACH(%d);"
+
 STRUCT_TYPE_DEFINE = """
 struct {name} {{
     {fields}
@@ -41,6 +45,16 @@ static void rb_init_state{bug_id}(void)
 
 CONSTRUCT_FIELD_SEP = "\n    "
 
+RESET_FUNC = """
+void rb_reset_states(void)
+{{
+    {fields}
+}}
+"""
+
+RESET_FIELD_DEFINE = "{var_name} = (struct {struct_name}){init_values};"
+RESET_FIELD_SEP = "\n    "
+
 DEFINE_BUG_MACRO = "#define " + BUG_MACRO
 
 
@@ -55,6 +69,54 @@ class StateStruct:
         return "rb_state%d_t" % self.bug_id
 
 
+class ReachSlots:
+    # counter slots for RB_REACH: one per code site, one per IfCond guard
+    def __init__(self):
+        self.slots: List[Dict[str, Any]] = []
+        self.index: Dict[Tuple[int, FileLine, Optional[int]], int] = dict()
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _add(self, bug_id: int, loc: FileLine, code_index: Optional[int], kind: str):
+        self.index[(bug_id, loc, code_index)] = len(self.slots)
+        self.slots.append({"bug": bug_id, "file": loc.filename, "kind": kind})
+
+    def add_bug(self, bug: Bug):
+        for loc, site in bug.iter_code_sites():
+            codes = site.get_code()
+            if len(codes) == 0:
+                continue
+            self._add(bug.bug_id, loc, None, "site")
+            for i, lazy in enumerate(codes):
+                if isinstance(lazy.code, IfCond):
+                    self._add(bug.bug_id, loc, i, "guard")
+
+    def annotate(self, bug_id: int, loc: FileLine, codes: List[str]) -> List[str]:
+        # counters go on existing lines, so line numbers stay the same as without them;
+        # codes[0] is the #ifdef line, codes[1] the first line compiled with the bug
+        slot = self.index.get((bug_id, loc, None))
+        if slot is None:
+            return codes
+        codes = list(codes)
+        first = codes[1]
+        indent = first[:len(first) - len(first.lstrip())]
+        codes[1] = indent + REACH_CALL % slot + " " + first.lstrip()
+        for i in range(len(codes)):
+            slot = self.index.get((bug_id, loc, i))
+            if slot is not None:
+                codes[i] += " " + REACH_CALL % slot
+        return codes
+
+    def set_line(self, bug_id: int, loc: FileLine, code_index: Optional[int], line: int):
+        slot = self.index.get((bug_id, loc, code_index))
+        if slot is not None:
+            self.slots[slot]["line"] = line
+
+    def dump(self, file_name: str):
+        write_file(file_name, json.dumps(self.slots, indent=1))
+
+
 class RaceBenchCode:
     def __init__(self, build_path: str):
         self.build_path = build_path
@@ -104,6 +166,7 @@ class RaceBenchCode:
 
         externs = []
         instances = []
+        resets = []
         for state in self.states:
             init_values = []
             for var in state.state_vars:
@@ -111,10 +174,14 @@ class RaceBenchCode:
             init_values = "{" + ", ".join(init_values) + "}"
             extern = STRUCT_EXTERN.format(struct_name=state.struct_name, var_name=state.state_name) + "\n"
             instance = STRUCT_INSTANCE.format(struct_name=state.struct_name, var_name=state.state_name, init_values=init_values)
+            # same initializers as the static instance, restored by racebench_reset
+            reset = RESET_FIELD_DEFINE.format(struct_name=state.struct_name, var_name=state.state_name, init_values=init_values)
             externs.append(extern)
             instances.append(instance)
+            resets.append(reset)
         externs = "\n".join(externs)
         instances = "\n".join(instances)
+        instances += "\n" + RESET_FUNC.format(fields=RESET_FIELD_SEP.join(resets))
 
         def apply_template(name: str, code: str):
             template_name = os.path.join(self.rbcode_path, name)
@@ -1,5 +1,6 @@
 #define _GNU_SOURCE
 #include "racebench.h"
+#include "racebench_bugs.h"
 #include <inttypes.h>
 #include <stdio.h>
 #include <stdlib.h>
@@ -18,6 +19,44 @@ uint8_t *rb_input;
 uint8_t rb_triggered = 0;
 
 racebench_statis rb_stat;
+/* runs already ended by racebench_reset */
+static racebench_statis rb_stat_done;
+static uint8_t rb_reset_called = 0;
+static const char *rb_input_file;
+
+#ifdef RACEBENCH_REACH
+#include <sys/mman.h>
+
+static uint64_t rb_reach_local[RB_REACH_SLOTS];
+uint64_t *rb_reach = rb_reach_local;
+
+/* share the counters through the file named by RACEBENCH_REACH_FILE, across runs */
+static void reach_init(void)
+{
+    char *out = getenv("RACEBENCH_REACH_FILE");
+    if (out == NULL)
+        return;
+    int fd = open(out, O_RDWR | O_CREAT, 0666);
+    if (fd == -1) {
+        perror("RaceBench cannot open reach file");
+        return;
+    }
+    size_t size = sizeof(uint64_t) * RB_REACH_SLOTS;
+    struct stat st;
+    if (fstat(fd, &st) == -1 || ((size_t)st.st_size < size && ftruncate(fd, size) == -1)) {
+        perror("RaceBench cannot resize reach file");
+        close(fd);
+        return;
+    }
+    void *mem = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (mem == MAP_FAILED) {
+        perror("RaceBench cannot map reach file");
+        return;
+    }
+    rb_reach = (uint64_t*)mem;
+}
+#endif
 
 static void read_input(const char *filename)
 {
@@ -29,6 +68,7 @@ static void read_input(const char *filename)
     fseek(file, 0, SEEK_END);
     rb_input_size = ftell(file);
     fseek(file, 0, SEEK_SET);
+    free(rb_input);
     rb_input = (uint8_t*)malloc(rb_input_size);
     fread(rb_input, 1, rb_input_size, file);
     fclose(file);
@@ -41,9 +81,13 @@ static void racebench_init(int argc, char **argv)
         fprintf(stderr, "RaceBench finds no argument %d\n", ARG_INPUT);
         exit(1);
     }
-    read_input(argv[ARG_INPUT]);
+    rb_input_file = argv[ARG_INPUT];
+    read_input(rb_input_file);
     memset(&rb_stat, 0, sizeof(racebench_statis));
     rb_stat.total_run = 1;
+#ifdef RACEBENCH_REACH
+    reach_init();
+#endif
 }
 
 static void crash(void)
@@ -76,10 +120,11 @@ static void dump_stats(void)
         return;
     }
 
-    rb_stat_old.total_run += rb_stat.total_run;
+    rb_stat_old.total_run += rb_stat_done.total_run + rb_stat.total_run;
     for (int i = 0; i < MAX_BUGNUM; ++i) {
-        rb_stat_old.trigger_num[i] += rb_stat.trigger_num[i];
-        if (rb_stat.trigger_num[i] > 0 && rb_stat_old.trigger_time[i] == 0)
+        uint64_t trigger_num = rb_stat_done.trigger_num[i] + rb_stat.trigger_num[i];
+        rb_stat_old.trigger_num[i] += trigger_num;
+        if (trigger_num > 0 && rb_stat_old.trigger_time[i] == 0)
             rb_stat_old.trigger_time[i] = time_now;
     }
 
@@ -117,3 +162,20 @@ void racebench_trigger(int bug_id)
     racebench_exit();
 #endif
 }
+
+void racebench_reset(void)
+{
+    /* a triggered run ends the same way as a process exit */
+    if (rb_triggered > 0)
+        racebench_exit();
+    /* the run before the first reset is only setup, not an iteration */
+    if (rb_reset_called)
+        rb_stat_done.total_run += rb_stat.total_run;
+    rb_reset_called = 1;
+    for (int i = 0; i < MAX_BUGNUM; ++i)
+        rb_stat_done.trigger_num[i] += rb_stat.trigger_num[i];
+    memset(&rb_stat, 0, sizeof(racebench_statis));
+    rb_stat.total_run = 1;
+    rb_reset_states();
+    read_input(rb_input_file);
+}
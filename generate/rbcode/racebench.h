@@ -24,6 +24,20 @@ extern racebench_statis rb_stat;
 
 void racebench_trigger(int bugid);
 
+/* for persistent loops: call at the start of every iteration, while no other thread
+   touches bug states. it ends the previous iteration and starts a new run with the
+   current input. N iterations record N runs, the code before the first call is not a run */
+void racebench_reset(void);
+
+/* build with -DRACEBENCH_REACH to count how often each bug site and guard is reached */
+#define RB_REACH_SLOTS {reach_slots}
+#ifdef RACEBENCH_REACH
+extern uint64_t *rb_reach;
+#define RB_REACH(slot) __atomic_fetch_add(&rb_reach[slot], 1, __ATOMIC_RELAXED)
+#else
+#define RB_REACH(slot)
+#endif
+
 #define EXIT_ONCE_TRIGGER
 
 #ifdef __cplusplus
@@ -11,6 +11,8 @@ extern "C" {
 
 {states}
 
+void rb_reset_states(void);
+
 #ifdef __cplusplus
 }
 #endif
@@ -1,10 +1,12 @@
-from typing import List
+from typing import List, Optional
+import threading
 import tempfile
 import json
 import os
 import subprocess
 
 from utils import *
+from rle import plain_file
 
 
 def repro_has_trigger(out_path: str) -> bool:
@@ -28,7 +30,8 @@ class Reproducer:
     def _tempfile(self):
         return tempfile.NamedTemporaryFile(mode="w", suffix=".repro.json", delete=False)
 
-    def run(self, trace_path: str) -> bool:
+    def run(self, trace_path: str, output_log: Optional[str] = None,
+            stop: Optional[threading.Event] = None) -> bool:
         exe_path = os.path.join(os.path.dirname(__file__), "..", "gdb_reproduce", "repro.py")
         config = {
             "cmd": self.cmd,
@@ -37,13 +40,16 @@ class Reproducer:
             "timeout": self.timeout,
             "trace": trace_path,
         }
-        with self._tempfile() as f:
-            config_file = f.name
-            json.dump(config, f)
         with tempfile.NamedTemporaryFile(mode="w", suffix=".out", delete=False) as f:
             out_path = f.name
-        subprocess.run(["python3", exe_path, config_file, out_path], check=True,
-                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with plain_file(trace_path) as plain_trace:
+            config["trace"] = plain_trace
+            with self._tempfile() as f:
+                config_file = f.name
+                json.dump(config, f)
+            with open_log(output_log) as out:
+                run_checked(["python3", exe_path, config_file, out_path], stop,
+                            stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT)
         ans = repro_has_trigger(out_path)
         remove_file(out_path)
         remove_file(config_file)
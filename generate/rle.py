@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from typing import Iterable, Iterator, TextIO, Tuple
+import itertools
+import tempfile
+
+from utils import *
+
+
+# Run-length encoded order/answer files start with this header line.
+# Every following line is a plain line, optionally followed by " *N"
+# when it repeats N times in a row. Published files stay plain, this is
+# only written when asked for.
+RleHeader = "#rle 1"
+RleCount = " *"
+
+
+def write_rle(f: TextIO, runs: Iterable[Tuple[str, int]]):
+    f.write(RleHeader + "\n")
+    for line, count in runs:
+        if count == 1:
+            f.write(line + "\n")
+        else:
+            f.write("%s%s%d\n" % (line, RleCount, count))
+
+
+def is_rle_file(file_name: str) -> bool:
+    with open(file_name, "r", encoding='latin-1') as f:
+        return f.readline().rstrip("\n") == RleHeader
+
+
+def read_runs(file_name: str) -> Iterator[Tuple[str, int]]:
+    # (line, count) runs of a plain or run-length encoded file
+    with open(file_name, "r", encoding='latin-1') as f:
+        first = f.readline()
+        rle = first.rstrip("\n") == RleHeader
+        lines = f if rle else itertools.chain([first], f)
+        for line in lines:
+            line = line.rstrip("\n")
+            if line == "":
+                continue
+            if rle:
+                body, sep, count = line.rpartition(RleCount)
+                if sep and count.isdigit():
+                    yield body, int(count)
+                    continue
+            yield line, 1
+
+
+@contextmanager
+def plain_file(file_name: str) -> Iterator[str]:
+    # the gdb tools only read plain files, so expand to a temporary copy
+    if not is_rle_file(file_name):
+        yield file_name
+        return
+    with tempfile.NamedTemporaryFile("w", encoding='latin-1', suffix=".txt", delete=False) as fout:
+        for line, count in read_runs(file_name):
+            fout.write((line + "\n") * count)
+        plain_name = fout.name
+    try:
+        yield plain_name
+    finally:
+        remove_file(plain_name)
@@ -0,0 +1,98 @@
+from typing import List, Optional, Tuple
+import random
+
+from bug import Bug, BugExecWrap
+from executor import InterleaveExec
+from compiler import CompiledCheckerExecutor, PieceCompiler
+from general import Interleave
+from error import LockError
+
+
+class ScheduleSimulator:
+    # Estimate how often a bug triggers without a forced order.
+    # Each thread keeps its own steps of the bug order, and the threads are
+    # merged by random step times drawn from their step rates in the trace.
+    # All threads start at time 0, so the sampled orders do not lean towards
+    # the traced one.
+    # The model is not calibrated against the native 100-run check, so it is
+    # only a pre-filter for bugs that trigger in most sampled schedules; the
+    # native check still decides BugTooEasy.
+    SampleNum = 200
+    PrefilterProb = 0.5
+
+    def __init__(self, bug: Bug, input_bytes: bytes, step_rates: List[float]):
+        self.bug = bug
+        self.input_bytes = input_bytes
+        self.step_rates = step_rates
+        self.threads = self._thread_steps()
+        self.compiler = PieceCompiler(input_bytes)
+
+    def _inert_kind(self, index: int) -> Optional[int]:
+        # moving between inert locations runs no code
+        site = self.bug.order.sites[index]
+        if site is None:
+            return 0
+        if len(self.bug.get_code(site.file_line)) == 0:
+            return 1
+        return None
+
+    def _thread_steps(self) -> List[List[Tuple[int, int]]]:
+        # (index in order, number of trace steps)
+        order = self.bug.order
+        threads: List[List[Tuple[int, int]]] = [[] for _ in range(len(self.step_rates))]
+        for index in range(len(order)):
+            steps = threads[order.tids[index]]
+            kind = self._inert_kind(index)
+            if kind is not None and len(steps) > 0 and self._inert_kind(steps[-1][0]) == kind:
+                _, count = steps[-1]
+                steps[-1] = (index, count + 1)
+            else:
+                steps.append((index, 1))
+        return threads
+
+    def sample_order(self) -> Interleave:
+        timed: List[Tuple[float, int]] = []
+        for tid, steps in enumerate(self.threads):
+            if len(steps) == 0:
+                continue
+            rate = self.step_rates[tid]
+            clock = 0.0
+            for index, count in steps:
+                clock += random.gammavariate(count, 1.0 / rate)
+                timed.append((clock, index))
+        timed.sort()
+        order = Interleave()
+        for _, index in timed:
+            order.append_step(self.bug.order, index)
+        return order
+
+    def run_once(self, order: Interleave) -> Optional[bool]:
+        checker = CompiledCheckerExecutor(self.input_bytes, self.compiler)
+        ex_chk = BugExecWrap(self.bug, checker)
+        ix_chk = InterleaveExec(order, ex_chk.execute, ex_chk.max_code_ptr)
+        try:
+            while ix_chk.next():
+                pass
+        except LockError:
+            # threads would block on the lock, this order cannot happen
+            return None
+        return checker.has_triggered()
+
+    def estimate(self, sample_num: int = SampleNum) -> float:
+        valid = 0
+        triggered = 0
+        for _ in range(sample_num):
+            result = self.run_once(self.sample_order())
+            if result is None:
+                continue
+            valid += 1
+            if result:
+                triggered += 1
+        if valid == 0:
+            return 0.0
+        return triggered / valid
+
+    def is_too_easy(self) -> bool:
+        rate = self.estimate()
+        self.bug.log.add_simulation(rate)
+        return rate >= self.PrefilterProb
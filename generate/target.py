@@ -1,23 +1,27 @@
+from __future__ import annotations
 import functools
-from typing import ByteString, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import ByteString, Callable, Dict, List, Optional, Set
 import os
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 import json
 from error import *
 import signal
 
 from utils import *
 from general import *
-from tracer import Trace
+from tracer import Trace, TraceWindow
 from build import Builder
 from mutate import Mutator
-from inject import InjectChecker, Injector
+from inject import InjectChecker, Injector, LineRemap
 from bug import Bug
 from bug_extract import BugExtractor
 from dom import DomAnalyzer
-from rbcode import RaceBenchCode
+from rbcode import REACH_MAP, RaceBenchCode, ReachSlots
 from piece import codes_to_indent_str
 from convert import Converter
 from reproduce import Reproducer
@@ -25,23 +29,90 @@ from reproduce import Reproducer
 
 BUG_TRIGGER_MESSAGE = b"RaceBench crashes deliberately"
 
+LINE_REMAP_FILE = "racebench_lines.json"
+
+GDB_TIMING_FILE = "gdb_timing.json"
+
 GDB_StepTimeout = 1
 
 
-def _bug_test_timeout(bug: Bug) -> float:
-    return GDB_StepTimeout * max(60, len(bug.order) / 3.0)
+class GdbTiming:
+    StepLatencyMultiplier = 50
+    MinStepTimeout = 0.1
+    MaxStepTimeout = 10
+    MinBugTimeout = 10
+    TraceTimeMultiplier = 5
+
+    def __init__(self):
+        # summed over all traces of the target, truncated ones included
+        self.trace_time = 0.0
+        self.trace_steps = 0
+        # longest trace that ran to the end, only these tell how long a full trace takes
+        self.full_trace_len = 0
+
+    def measure(self, trace_time: float, trace_len: int, truncated: bool):
+        self.trace_time += trace_time
+        self.trace_steps += trace_len
+        if not truncated:
+            self.full_trace_len = max(self.full_trace_len, trace_len)
+        print("gdb step latency %.4f, step timeout %.3f" % (self.step_latency, self.step_timeout))
+
+    @property
+    def step_latency(self) -> Optional[float]:
+        if self.trace_steps == 0:
+            return None
+        return self.trace_time / self.trace_steps
+
+    @property
+    def step_timeout(self) -> float:
+        if self.step_latency is None:
+            return GDB_StepTimeout
+        step_timeout = self.step_latency * self.StepLatencyMultiplier
+        return min(max(step_timeout, self.MinStepTimeout), self.MaxStepTimeout)
+
+    def bug_timeout(self, bug: Bug) -> float:
+        timeout = self.step_timeout * max(60, len(bug.order) / 3.0)
+        return max(timeout, self.MinBugTimeout)
+
+    def trace_timeout(self, default: float) -> float:
+        if self.step_latency is None or self.full_trace_len == 0:
+            return default
+        timeout = self.step_latency * self.full_trace_len * self.TraceTimeMultiplier
+        return max(timeout, self.MinBugTimeout)
+
+    def dump(self, file_name: str):
+        data = {
+            "trace_time": self.trace_time,
+            "trace_steps": self.trace_steps,
+            "full_trace_len": self.full_trace_len,
+        }
+        # runs on the same origin may finish a trace at the same time
+        write_file_atomic(file_name, json.dumps(data, indent=4).encode())
+
+    @staticmethod
+    def load(file_name: str) -> GdbTiming:
+        timing = GdbTiming()
+        if os.path.isfile(file_name):
+            data = json.loads(read_file(file_name))
+            timing.trace_time = data["trace_time"]
+            timing.trace_steps = data["trace_steps"]
+            timing.full_trace_len = data["full_trace_len"]
+        return timing
 
 
 class TargetCode:
 
-    def __init__(self, origin: str, code_dir: str):
+    def __init__(self, origin: str, code_dir: str, timing: Optional[GdbTiming] = None):
         self.code_dir = code_dir
+        self.timing = timing if timing is not None else GdbTiming()
         self.install_dir = os.path.join(self.code_dir, "racebench")
         shutil.copytree(origin, self.code_dir, dirs_exist_ok=is_empty_dir(self.code_dir))
         self.builder = Builder(self.code_dir)
         self.rbcode = RaceBenchCode(self.code_dir)
         self._parse_code_config()
         self.injector = Injector()
+        self.line_remap = LineRemap()
+        self.reach_slots = ReachSlots()
 
     def _parse_commands(self):
         commands = read_file(os.path.join(self.code_dir, "command.txt"))
@@ -65,48 +136,68 @@ class TargetCode:
         except subprocess.CalledProcessError:
             return False
 
-    def build_debug(self):
-        self.builder.rebuild_and_install(debug_info=True, dump_cmd=True)
+    def build_debug(self, stop: Optional[threading.Event] = None):
+        self.builder.rebuild_and_install(debug_info=True, dump_cmd=True, stop=stop)
 
     def _add_racebench_code(self, bugs: List[Bug]):
         arg_input = self.exec_command.index("{input_file}")
         max_bug_id = max(bug.bug_id for bug in bugs)
-        defs = {"bug_num": max_bug_id + 1, "arg_input": arg_input}
+        defs = {"bug_num": max_bug_id + 1, "arg_input": arg_input,
+                "reach_slots": max(1, len(self.reach_slots))}
         self.rbcode.copy_preset_files(defs)
         for bug in bugs:
             self.rbcode.add_state(bug)
         self.rbcode.dump_state_defs()
 
     def inject_bugs(self, bugs: List[Bug]):
+        self.reach_slots = ReachSlots()
+        for bug in bugs:
+            self.reach_slots.add_bug(bug)
         self._add_racebench_code(bugs)
         file_names = set().union(*[b.get_all_files() for b in bugs])
         for name in file_names:
             self.rbcode.prepend_state_defs(self.injector, name)
-        ins_acc = AccInsertionPoint()
         for bug in bugs:
-            self._injector_add_bug(ins_acc, bug)
-        self.injector.commit()
+            self._injector_add_bug(bug)
+        self.line_remap = self.injector.commit().relative_to(self.code_dir)
+        self.line_remap.dump(os.path.join(self.code_dir, LINE_REMAP_FILE))
         for bug in bugs:
             self._bug_reorder(bug)
+            self._reach_set_lines(bug)
+        self.reach_slots.dump(os.path.join(self.code_dir, REACH_MAP))
 
-    def _injector_add_bug(self, ins_acc: AccInsertionPoint, bug: Bug):
+    def _injector_add_bug(self, bug: Bug):
         for loc, site in bug.iter_code_sites():
             filename = os.path.join(self.code_dir, loc.filename)
-            loc = InjectLocation(FileLine(filename, loc.line), LineLoc.Before)
+            ins_loc = InjectLocation(FileLine(filename, loc.line), LineLoc.Before)
             codes = [code.code for code in site.get_code()]
             assert None not in codes
             codes = codes_to_indent_str(codes)
-            ins_point = self.injector.add(loc, codes)
-            result_line_getter = ins_acc.add_insertion_point(ins_point)
-            site.set_result_line_getter(result_line_getter)
+            codes = self.reach_slots.annotate(bug.bug_id, loc, codes)
+            site.set_insertion(self.injector.add(ins_loc, codes))
+
+    def _reach_set_lines(self, bug: Bug):
+        for loc, site in bug.iter_code_sites():
+            if len(site.get_code()) == 0:
+                continue
+            self.reach_slots.set_line(bug.bug_id, loc, None, site.get_result_line(1))
+            for i in range(len(site.get_code())):
+                self.reach_slots.set_line(bug.bug_id, loc, i, site.get_result_line(i))
 
     def _bug_reorder(self, bug: Bug):
-        for i in range(len(bug.order)):
-            loc = bug.order[i].location
-            if loc is None:
+        order = bug.order
+        for i in range(len(order)):
+            site = order.sites[i]
+            if site is None:
                 continue
-            new_line = loc.site.get_result_line(loc.code_ptr)
-            loc.set_new_line(new_line)
+            code_ptr = order.code_ptrs[i]
+            if code_ptr == Interleave.NoCodePtr:
+                # every bug file got the state defs prepended, so it must be remapped
+                assert self.line_remap.has_file(site.filename), site.filename
+                new_line = self.line_remap.map_line(site.filename, site.line)
+            else:
+                new_line = site.get_result_line(code_ptr)
+            order.set_new_line(i, new_line)
 
     def cleanup(self):
         self.builder.clean()
@@ -132,34 +223,51 @@ class TargetCode:
             print("bug check timeout")
             return True
 
-    def check_reproduce(self, bug: Bug, answer_file: str) -> bool:
+    def check_reproduce(self, bug: Bug, answer_file: str, output_log: Optional[str] = None,
+                        stop: Optional[threading.Event] = None) -> bool:
         print("check reproduce %d" % bug.bug_id)
         repro = Reproducer(
             cmd=self.command_line(bug.input_file),
             cwd=self.code_dir,
-            step_timeout=GDB_StepTimeout,
-            timeout=_bug_test_timeout(bug),
+            step_timeout=self.timing.step_timeout,
+            timeout=self._bug_timeout(bug),
         )
-        return repro.run(answer_file)
+        return repro.run(answer_file, output_log, stop)
 
-    def convert_answer(self, bug: Bug, order_file: str, answer_file: str):
-        converter = Converter(
+    def _bug_timeout(self, bug: Bug) -> float:
+        timeout = self.timing.bug_timeout(bug)
+        print("bug %d gdb step timeout %.3f, timeout %.1f" % (bug.bug_id, self.timing.step_timeout, timeout))
+        return timeout
+
+    def _converter(self, bug: Bug) -> Converter:
+        return Converter(
             cmd=self.command_line(bug.input_file),
             srcdir=".",
-            step_timeout=GDB_StepTimeout,
+            step_timeout=self.timing.step_timeout,
             cwd=self.code_dir,
-            timeout=_bug_test_timeout(bug),
+            timeout=self._bug_timeout(bug),
         )
-        converter.run(order_file, answer_file)
+
+    def convert_answer(self, bug: Bug, order_file: str, answer_file: str, output_log: Optional[str] = None,
+                       stop: Optional[threading.Event] = None):
+        self._converter(bug).run(order_file, answer_file, output_log, stop)
 
 
 class TargetProgram:
     GDB_TimeoutMultiplier = 20
     EasyCheckNum = 100
+    ParallelJobs = os.cpu_count() or 1
+    # CPUs kept for one candidate's easy check, so concurrent checks do not slow each other down
+    EasyCheckCpus = 4
 
-    def __init__(self, origin: str, target_root: str, mutate_num: int):
+    def __init__(self, origin: str, target_root: str, mutate_num: int, trace_margin: int = 0,
+                 rle_orders: bool = False):
         self.root = os.path.abspath(target_root)
         self.mutate_num = mutate_num
+        # stop tracing after this many multi-thread positions, 0 traces the whole run
+        self.trace_margin = trace_margin
+        # write the temporary orders of candidate checks run-length encoded, published ones stay plain
+        self.rle_orders = rle_orders
 
         self.code_dir = os.path.join(self.root, "code")
         self.input_dir = os.path.join(self.root, "input")
@@ -172,13 +280,21 @@ class TargetProgram:
         os.mkdir(self.log_dir)
         os.mkdir(self.trace_dir)
 
-        self.target_code = TargetCode(origin, self.code_dir)
+        # kept next to the target's timeout file, so later runs on the same origin reuse it
+        self.timing_file = os.path.join(origin, GDB_TIMING_FILE)
+        timing = GdbTiming.load(self.timing_file)
+        self.target_code = TargetCode(origin, self.code_dir, timing)
         self._copy_input_seed()
         self._parse_blacklist(os.path.join(self.code_dir, "blacklist.txt"))
         self.mutator = Mutator(self.has_new_thread)
         self.inject_checker = InjectChecker(self.blacklist)
+        self.inject_file_ids: Dict[str, int] = dict()
         self.dom = DomAnalyzer(self.code_dir)
         self.bugs: List[Bug] = []
+        # bugs without an answer file, reproducing them again is pointless
+        self.convert_failed: Set[int] = set()
+        self.check_jobs = max(1, self.ParallelJobs // self.EasyCheckCpus)
+        self.easy_slots = threading.BoundedSemaphore(self.check_jobs)
 
     def _copy_input_seed(self):
         shutil.copy(os.path.join(self.code_dir, "input-seed"), self.input_dir)
@@ -191,6 +307,10 @@ class TargetProgram:
     def exec_timeout(self) -> float:
         return self.target_code.exec_timeout
 
+    @property
+    def timing(self) -> GdbTiming:
+        return self.target_code.timing
+
     def build_debug(self):
         print("build debug")
         self.target_code.build_debug()
@@ -243,22 +363,30 @@ class TargetProgram:
             "cwd": self.code_dir,
             "log": trace_file_name,
             "blacklist": black_file_name,
-            "steptime": GDB_StepTimeout,
-            "timeout": self.exec_timeout * self.GDB_TimeoutMultiplier,
+            "steptime": self.timing.step_timeout,
+            "timeout": self.timing.trace_timeout(self.exec_timeout * self.GDB_TimeoutMultiplier),
         }
+        print("trace step timeout %.3f, timeout %.1f" % (config["steptime"], config["timeout"]))
         with tempfile.NamedTemporaryFile(
             mode="w", prefix=uuid, suffix=".trace.json", dir=self.log_dir, delete=False,
         ) as config_file:
             json.dump(config, config_file)
             config_file.flush()
-            trace = Trace.run(config_file.name)
+            start_time = time.time()
+            window = TraceWindow(self.bug_location_checker, self.trace_margin)
+            trace = Trace.run(config_file.name, window)
+            self.timing.measure(time.time() - start_time, len(trace), trace.truncated)
+            self.timing.dump(self.timing_file)
         return trace
 
     def bug_location_checker(self, fileline: Optional[FileLine]) -> bool:
         if fileline is None:
             return False
-        x = fileline.extend_path(self.code_dir)
-        return self.inject_checker.can_insert_before(x.filename, x.line)
+        file_id = self.inject_file_ids.get(fileline.filename)
+        if file_id is None:
+            file_id = self.inject_checker.file_id(extend_path(fileline.filename, self.code_dir))
+            self.inject_file_ids[fileline.filename] = file_id
+        return self.inject_checker.can_insert_at(file_id, fileline.line)
 
     def temp_input_file(self, input_bytes: bytes, uuid: str):
         with tempfile.NamedTemporaryFile(
@@ -274,26 +402,36 @@ class TargetProgram:
         input_bytes = self.mutate_input()
         input_file = self.temp_input_file(input_bytes, uuid)
         trace = self._get_trace(input_file, uuid)
-        bug_checker = lambda bug: self._check_bug_trigger(bug, uuid)
-        bug_extractor = BugExtractor(self.bug_location_checker, self.dom, bug_checker)
+        bug_checker = lambda bug, stop: self._check_bug_trigger(bug, uuid, stop)
+        bug_extractor = BugExtractor(self.bug_location_checker, self.dom, bug_checker,
+                                     check_jobs=self.check_jobs)
         bug = bug_extractor.extract(bug_id, trace, input_file, path_len)
         self.bugs.append(bug)
 
-    def _check_bug_trigger(self, bug: Bug, uuid: str):
+    def _check_bug_trigger(self, bug: Bug, uuid: str, stop: threading.Event):
         tmpdir = tempfile.TemporaryDirectory(prefix=uuid, suffix=".code", dir=self.log_dir)
-        temp_target = TargetCode(self.code_dir, tmpdir.name)
-        temp_target.inject_bugs([bug])
-        temp_target.build_debug()
-        for _ in range(self.EasyCheckNum):
-            if temp_target.check_too_easy(bug.input_file):
-                raise BugTooEasy
+        # the copy and build share the CPU budget of the easy checks, so they cannot
+        # slow down another candidate's timed runs into spurious too-easy rejections
+        with self.easy_slots:
+            if stop.is_set():
+                raise CheckCancelled
+            temp_target = TargetCode(self.code_dir, tmpdir.name, self.timing)
+            temp_target.inject_bugs([bug])
+            if stop.is_set():
+                raise CheckCancelled
+            temp_target.build_debug(stop)
+            for _ in range(self.EasyCheckNum):
+                if stop.is_set():
+                    raise CheckCancelled
+                if temp_target.check_too_easy(bug.input_file):
+                    raise BugTooEasy
         with tempfile.NamedTemporaryFile(suffix=".order", dir=tmpdir.name, delete=False) as f:
             order_file = f.name
         with tempfile.NamedTemporaryFile(suffix=".answer", dir=tmpdir.name, delete=False) as f:
             answer_file = f.name
-        bug.dump_order(order_file)
-        temp_target.convert_answer(bug, order_file, answer_file)
-        if not temp_target.check_reproduce(bug, answer_file):
+        bug.dump_order(order_file, rle=self.rle_orders)
+        temp_target.convert_answer(bug, order_file, answer_file, stop=stop)
+        if not temp_target.check_reproduce(bug, answer_file, stop=stop):
             raise CantReproduce
 
     def inject_bugs(self):
@@ -306,8 +444,8 @@ class TargetProgram:
             self._dump_input_file(bug)
             self._dump_order_file(bug)
         print("convert answer")
-        for bug in self.bugs:
-            self._dump_answer_file(bug)
+        converted = self._map_bugs(self.bugs, self._dump_answer_file)
+        self.convert_failed = set(bug_id for bug_id, ok in converted.items() if not ok)
 
     def bug_log_file(self, bug_id: int):
         return os.path.join(self.trace_dir, "bug-%d.json" % bug_id)
@@ -321,6 +459,9 @@ class TargetProgram:
     def bug_answer_file(self, bug_id: int):
         return os.path.join(self.trace_dir, "answer-%d.txt" % bug_id)
 
+    def bug_tool_log(self, bug_id: int, tool: str):
+        return os.path.join(self.log_dir, "%s-%d.log" % (tool, bug_id))
+
     def _dump_bug_log_file(self, bug: Bug):
         file_name = self.bug_log_file(bug.bug_id)
         write_file(file_name, json.dumps(bug.log.get_items(), indent=4))
@@ -333,17 +474,44 @@ class TargetProgram:
         file_name = self.bug_order_file(bug.bug_id)
         bug.dump_order(file_name)
 
-    def _dump_answer_file(self, bug: Bug):
+    def _dump_answer_file(self, bug: Bug) -> bool:
         order_file = self.bug_order_file(bug.bug_id)
         answer_file = self.bug_answer_file(bug.bug_id)
-        return self.target_code.convert_answer(bug, order_file, answer_file)
+        output_log = self.bug_tool_log(bug.bug_id, "convert")
+        self.target_code.convert_answer(bug, order_file, answer_file, output_log)
+        return True
+
+    def _reproduce_answer_file(self, bug: Bug) -> bool:
+        answer_file = self.bug_answer_file(bug.bug_id)
+        output_log = self.bug_tool_log(bug.bug_id, "reproduce")
+        return self.target_code.check_reproduce(bug, answer_file, output_log)
+
+    def _map_bugs(self, bugs: List[Bug], func: Callable[[Bug], bool]) -> Dict[int, bool]:
+        # each bug has its own input and answer file, so the gdb runs are independent
+        results: Dict[int, bool] = dict()
+        with ThreadPoolExecutor(max_workers=self.ParallelJobs) as pool:
+            futures = {pool.submit(func, bug): bug.bug_id for bug in bugs}
+            for future in as_completed(futures):
+                bug_id = futures[future]
+                try:
+                    results[bug_id] = future.result()
+                except (subprocess.CalledProcessError, AssertionError) as e:
+                    print("bug %d failed: %s" % (bug_id, type(e).__name__))
+                    results[bug_id] = False
+        return results
 
     def dump_install(self):
         old_install = os.path.join(self.code_dir, "racebench")
         shutil.copytree(old_install, self.install_dir)
 
     def check_reproduce_all(self):
-        for bug in self.bugs:
-            answer_file = self.bug_answer_file(bug.bug_id)
-            if not self.target_code.check_reproduce(bug, answer_file):
-                raise CantReproduce(bug.bug_id)
+        pending = [bug for bug in self.bugs if bug.bug_id not in self.convert_failed]
+        reproduced = self._map_bugs(pending, self._reproduce_answer_file)
+        failed = sorted(bug_id for bug_id, ok in reproduced.items() if not ok)
+        if len(failed) > 0:
+            print("cannot reproduce bugs", failed)
+        if len(self.convert_failed) > 0:
+            print("cannot convert bugs", sorted(self.convert_failed))
+            raise CantConvert(*sorted(self.convert_failed))
+        if len(failed) > 0:
+            raise CantReproduce(*failed)
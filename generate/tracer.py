@@ -1,10 +1,13 @@
 from __future__ import annotations
-from typing import Dict, List, Optional, Set
+from array import array
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import os
+import signal
 import subprocess
 import json
 import re
 import ast
+import time
 
 from general import FileLine, LineLoc
 from utils import *
@@ -14,6 +17,8 @@ log_pattern = re.compile(r"(\d+) ([=>]) (None|(.*):(\d+))\s*")
 
 
 class ThreadPos:
+    __slots__ = ("tid", "line_loc", "file_line")
+
     def __init__(self, tid: int, line_loc: LineLoc, file_line: Optional[FileLine]):
         self.tid = tid
         self.line_loc = line_loc
@@ -44,18 +49,66 @@ def parse_logs(log_path: str) -> List[ThreadPos]:
     return ans
 
 
+class LogTail:
+    # reads complete lines of a log file that is still being written
+    def __init__(self, log_path: str):
+        self.log_path = log_path
+        self.offset = 0
+        self.partial = ""
+
+    def read_lines(self) -> List[str]:
+        try:
+            with open(self.log_path, "r", encoding='latin-1') as f:
+                f.seek(self.offset)
+                data = f.read()
+                self.offset = f.tell()
+        except FileNotFoundError:
+            return []
+        lines = (self.partial + data).split("\n")
+        self.partial = lines.pop()
+        return lines
+
+
+class TraceWindow:
+    # counts trace positions where at least two threads are before an injectable line,
+    # the same condition BugExtractState.random_index looks for
+    def __init__(self, checker: Callable[[FileLine], bool], margin: int):
+        self.checker = checker
+        self.margin = margin
+        self.ready_threads: Set[int] = set()
+        self.count = 0
+
+    def feed(self, tpos: ThreadPos):
+        if tpos.line_loc == LineLoc.Before and tpos.file_line is not None and self.checker(tpos.file_line):
+            self.ready_threads.add(tpos.tid)
+        else:
+            self.ready_threads.discard(tpos.tid)
+        if len(self.ready_threads) >= 2:
+            self.count += 1
+
+    def is_full(self) -> bool:
+        return self.count >= self.margin
+
+
 def parse_blacklist(black_path: str) -> Dict[str, Set[int]]:
     lines = read_file(black_path).split("\n")
     ans: Dict[str, Set[int]] = dict()
-    for line in lines:
+    for i, line in enumerate(lines):
         pos = line.find(":")
         if pos == -1:
             continue
         filename = line[:pos].strip()
-        lines = ast.literal_eval(line[pos + 1:])
+        try:
+            file_lines = ast.literal_eval(line[pos + 1:])
+        except (SyntaxError, ValueError):
+            # a trace stopped by TraceWindow can leave the last line half written
+            if all(rest.strip() == "" for rest in lines[i + 1:]):
+                print("ignore truncated blacklist line")
+                break
+            raise
         if filename not in ans:
             ans[filename] = set()
-        ans[filename].update(lines)
+        ans[filename].update(file_lines)
     return ans
 
 
@@ -63,18 +116,20 @@ class Trace:
     def __init__(self, positions: List[ThreadPos], blacklist: Dict[str, Set[int]], srcdir: str):
         self.srcdir = srcdir
         self.blacklist = blacklist
+        # stopped early by a TraceWindow
+        self.truncated = False
 
         tmax = max(tpos.tid for tpos in positions)
         self.num_threads = tmax + 1
 
         self.pos_table = [ThreadPos(-1, True, None)]
-        self.pos_index = [[0] * (tmax + 1)]
+        # flattened (len(pos_table), num_threads) table of each thread's last position
+        self.pos_index = array("I", [0] * self.num_threads)
+        cur_index = self.pos_index[:]
         for tpos in positions:
-            idx = len(self.pos_table)
+            cur_index[tpos.tid] = len(self.pos_table)
             self.pos_table.append(tpos)
-            cur_index = self.pos_index[-1][:]
-            cur_index[tpos.tid] = idx
-            self.pos_index.append(cur_index)
+            self.pos_index.extend(cur_index)
 
     def __len__(self) -> int:
         return len(self.pos_table)
@@ -82,8 +137,15 @@ class Trace:
     def __getitem__(self, index) -> ThreadPos:
         return self.pos_table[index]
 
+    def thread_step_rates(self) -> List[float]:
+        counts = [0] * self.num_threads
+        for tpos in self.pos_table[1:]:
+            counts[tpos.tid] += 1
+        total = max(1, sum(counts))
+        return [c / total for c in counts]
+
     def thread_pos(self, tnum: int, idx: int) -> ThreadPos:
-        return self.pos_table[self.pos_index[idx][tnum]]
+        return self.pos_table[self.pos_index[idx * self.num_threads + tnum]]
 
     def in_blacklist(self, file_line: FileLine) -> bool:
         filename = file_line.filename
@@ -91,17 +153,75 @@ class Trace:
             return False
         return file_line.line in self.blacklist[filename]
 
+    PollInterval = 0.1
+    KillTimeout = 5
+
     @staticmethod
-    def run(config_file: str) -> Trace:
+    def run(config_file: str, window: Optional[TraceWindow] = None) -> Trace:
         exe_path = os.path.join(os.path.dirname(__file__), "..", "gdb_trace", "trace.py")
-        subprocess.run(["python3", exe_path, config_file],
-                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         with open(config_file, "r", encoding='latin-1') as f:
             config = json.load(f)
         cwd = config["cwd"]
         log_path = extend_path(config["log"], cwd)
         black_path = extend_path(config["blacklist"], cwd)
         srcdir = extend_path(config["srcdir"], cwd)
-        logs = parse_logs(log_path)
+        truncated = False
+        if window is None or window.margin <= 0:
+            subprocess.run(["python3", exe_path, config_file],
+                           check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            logs = parse_logs(log_path)
+        else:
+            logs, truncated = Trace._run_window(exe_path, config_file, log_path, window)
         blacklist = parse_blacklist(black_path)
-        return Trace(logs, blacklist, srcdir)
+        trace = Trace(logs, blacklist, srcdir)
+        trace.truncated = truncated
+        return trace
+
+    @staticmethod
+    def _run_window(exe_path: str, config_file: str, log_path: str,
+                    window: TraceWindow) -> Tuple[List[ThreadPos], bool]:
+        # tail the log and stop gdb with its inferior once the window has enough positions
+        cmd = ["python3", exe_path, config_file]
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=True)
+        tail = LogTail(log_path)
+        logs: List[ThreadPos] = []
+        stopped = False
+        try:
+            while True:
+                exited = proc.poll() is not None
+                for line in tail.read_lines():
+                    tpos = parse_log_line(line)
+                    if tpos is None:
+                        continue
+                    logs.append(tpos)
+                    window.feed(tpos)
+                if exited:
+                    break
+                if window.is_full():
+                    print("trace stopped at %d steps" % len(logs))
+                    stopped = True
+                    break
+                time.sleep(Trace.PollInterval)
+        finally:
+            if proc.poll() is None:
+                Trace._kill(proc)
+        if not stopped:
+            # whatever was written without a final newline
+            tpos = parse_log_line(tail.partial)
+            if tpos is not None:
+                logs.append(tpos)
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd)
+        return logs, stopped
+
+    @staticmethod
+    def _kill(proc: subprocess.Popen):
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait(Trace.KillTimeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+            proc.wait()
+        except ProcessLookupError:
+            proc.wait()
@@ -0,0 +1,46 @@
+from functools import reduce
+from typing import List
+import operator
+
+
+# Values are plain ints in [0, 2**32), wrapped like uint32_t in the generated C.
+
+TVal = int
+Mask = (1 << 32) - 1
+
+
+def u32(x: int) -> TVal:
+    return x & Mask
+
+
+def c_literal(x: TVal) -> str:
+    # unsigned suffix, so constant expressions never overflow a signed int in C
+    return "%su" % hex(u32(x))
+
+
+def eval_op(op: str, args: List[TVal]) -> TVal:
+    if op == "+":
+        return sum(args) & Mask
+    elif op == "^":
+        return reduce(operator.xor, args)
+    elif op == "-":
+        if len(args) == 1:
+            return -args[0] & Mask
+        elif len(args) == 2:
+            return (args[0] - args[1]) & Mask
+    elif op == "!":
+        if len(args) == 1:
+            return int(args[0] == 0)
+    elif op == "==":
+        if len(args) == 2:
+            return int(args[0] == args[1])
+    elif op == "!=":
+        if len(args) == 2:
+            return int(args[0] != args[1])
+    elif op == "&&":
+        if len(args) == 2:
+            return int(bool(args[0]) and bool(args[1]))
+    elif op == "?:":
+        if len(args) == 3:
+            return args[1] if args[0] else args[2]
+    raise NotImplementedError
@@ -1,5 +1,11 @@
-from typing import AnyStr
+from typing import AnyStr, IO, List, Optional
 import os
+import signal
+import subprocess
+import tempfile
+import threading
+
+from error import CheckCancelled
 
 
 def read_file(filename: str, raw: bool = False) -> AnyStr:
@@ -17,6 +23,53 @@ def write_file(filename: str, data: AnyStr):
         f.write(data)
 
 
+def write_file_atomic(filename: str, data: bytes):
+    # concurrent writers of the same content may race, the last rename wins
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename), prefix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        remove_file(tmp_name)
+        raise
+
+
+def cache_dir(*names: str) -> str:
+    root = os.environ.get("RACEBENCH_CACHE", os.path.expanduser("~/.cache/racebench"))
+    path = os.path.join(root, *names)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def run_checked(cmd: List[str], stop: Optional[threading.Event] = None, **kwargs):
+    # like subprocess.run(check=True), but the whole process group is killed once stop is set
+    if stop is None:
+        subprocess.run(cmd, check=True, **kwargs)
+        return
+    proc = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+    while True:
+        try:
+            retcode = proc.wait(0.5)
+            break
+        except subprocess.TimeoutExpired:
+            if stop.is_set():
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                proc.wait()
+                raise CheckCancelled
+    if retcode != 0:
+        raise subprocess.CalledProcessError(retcode, cmd)
+
+
+def open_log(filename: Optional[str]) -> IO:
+    if filename is None:
+        return open(os.devnull, 'w')
+    return open(filename, 'a', encoding='latin-1')
+
+
 def remove_file(filename: str):
     if os.path.isfile(filename):
         os.unlink(filename)
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
 import sys
+import os
+import time
+import json
 import struct
 import datetime
+import argparse
+from collections import deque
 
 
 """
@@ -24,11 +29,7 @@ def show(name, data):
     print("%s (sum %d, unique %d): %s" % (name, sum(data), sum(map(bool, data)), l2s(data)))
 
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: %s <rb_stat>" % sys.argv[0])
-        exit(0)
-    filename = sys.argv[1]
+def show_file(filename):
     with open(filename, "rb") as f:
         data = f.read()
     
@@ -55,5 +56,276 @@ def main():
     print("find bugs:", [i for i in range(bug_num) if trigger_num[i]>0])
 
 
+def find_stat_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.endswith(".rb_stat"):
+                    yield os.path.join(root, name)
+
+
+def load_stat(filename):
+    import numpy
+    data = numpy.fromfile(filename, dtype="<u8")
+    bug_num = (len(data) - 1) // 2
+    assert len(data) == bug_num * 2 + 1, "bad stat file %s" % filename
+    return data[0], data[1:bug_num + 1], data[bug_num + 1:]
+
+
+def group_key(filename, level):
+    key = os.path.abspath(filename)
+    for _ in range(level):
+        key = os.path.dirname(key)
+    return key
+
+
+def analyze_group(files, start=None, curve_points=100):
+    import numpy
+    stats = [load_stat(f) for f in files]
+    bug_num = max(len(num) for _, num, _ in stats)
+    reps = len(stats)
+    total_run = numpy.array([run for run, _, _ in stats], dtype=numpy.float64)
+    trigger_num = numpy.zeros((reps, bug_num), dtype=numpy.uint64)
+    trigger_time = numpy.zeros((reps, bug_num), dtype=numpy.float64)
+    for i, (_, num, tm) in enumerate(stats):
+        trigger_num[i, :len(num)] = num
+        trigger_time[i, :len(tm)] = tm
+    found = trigger_num > 0
+    res = {
+        "reps": reps,
+        "total_run": int(total_run.sum()),
+        "found_reps": found.sum(axis=0),
+        "discovery_rate": found.mean(axis=0),
+        "triggers": trigger_num.sum(axis=0),
+        "trigger_per_run": trigger_num.sum(axis=0) / max(1.0, total_run.sum()),
+        "unique_bugs": found.sum(axis=1),
+    }
+    if start is None:
+        # a trigger time alone says nothing about how long the repetition ran
+        return res
+    ttft = numpy.where(found, trigger_time - start, numpy.nan)
+
+    # mean number of unique bugs found per repetition over time
+    end = numpy.nanmax(ttft) if found.any() else 0.0
+    curve_time = numpy.linspace(0, end, curve_points)
+    unique = (ttft[:, :, None] <= curve_time[None, None, :]).sum(axis=1)
+    curve = numpy.vstack([curve_time, unique.mean(axis=0)])
+
+    with numpy.errstate(all="ignore"):
+        res.update({
+            "ttft": ttft,
+            "ttft_min": numpy.nanmin(numpy.where(found, ttft, numpy.inf), axis=0),
+            "ttft_median": numpy.array([numpy.median(ttft[found[:, b], b]) if found[:, b].any() else numpy.nan
+                                        for b in range(bug_num)]),
+            "ttft_max": numpy.nanmax(numpy.where(found, ttft, -numpy.inf), axis=0),
+            "curve": curve,
+        })
+    return res
+
+
+def read_stat(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    bug_num = (len(data) // 8 - 1) // 2
+    if len(data) != 8 * (bug_num * 2 + 1):
+        # caught in the middle of a write
+        return None
+    unpacked = struct.unpack("<%dQ" % (bug_num * 2 + 1), data)
+    return unpacked[0], unpacked[1:bug_num + 1]
+
+
+class StatWatcher:
+    RescanPolls = 10
+
+    def __init__(self, paths, group_level, window, collapse):
+        self.paths = paths
+        self.group_level = group_level
+        self.window = window
+        self.collapse = collapse
+        self.files = dict()  # filename -> [(mtime_ns, size), total_run, trigger_num]
+        self.history = dict()  # group -> deque of (time, total_run)
+        self.peak = dict()
+        self.polls = 0
+
+    def scan(self):
+        for filename in find_stat_files(self.paths):
+            if filename not in self.files:
+                self.files[filename] = [None, 0, ()]
+
+    def poll(self, now):
+        if self.polls % StatWatcher.RescanPolls == 0:
+            self.scan()
+        self.polls += 1
+        group_runs = dict()
+        for filename, entry in self.files.items():
+            try:
+                st = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            sig = (st.st_mtime_ns, st.st_size)
+            if sig != entry[0]:
+                stat = read_stat(filename)
+                if stat is not None:
+                    if entry[0] is not None:
+                        self.report_triggers(filename, entry[2], stat[1])
+                    entry[0], entry[1], entry[2] = sig, stat[0], stat[1]
+            group = group_key(filename, self.group_level)
+            group_runs[group] = group_runs.get(group, 0) + entry[1]
+        for group, runs in sorted(group_runs.items()):
+            self.report_rate(group, now, runs)
+
+    @staticmethod
+    def report_triggers(filename, old, new):
+        deltas = []
+        for bug, num in enumerate(new):
+            last = old[bug] if bug < len(old) else 0
+            if num > last:
+                deltas.append("bug %d +%d" % (bug, num - last))
+        if len(deltas) > 0:
+            print("%s: %s" % (filename, ", ".join(deltas)))
+
+    def report_rate(self, group, now, runs):
+        history = self.history.setdefault(group, deque())
+        history.append((now, runs))
+        while len(history) > 2 and now - history[1][0] >= self.window:
+            history.popleft()
+        first_time, first_runs = history[0]
+        if now <= first_time:
+            return
+        rate = (runs - first_runs) / (now - first_time)
+        warm = now - first_time >= self.window
+        peak = self.peak.get(group, 0.0)
+        if warm:
+            self.peak[group] = max(peak, rate)
+        alert = ""
+        if warm and peak > 0 and rate < peak * self.collapse:
+            alert = "  ALERT: exec/s dropped below %d%% of peak %.1f" % (self.collapse * 100, peak)
+        print("%s %s: %d runs, %.1f exec/s%s" % (
+            time.strftime("%H:%M:%S", time.localtime(now)), group, runs, rate, alert))
+        sys.stdout.flush()
+
+
+def watch(args):
+    watcher = StatWatcher(args.paths, args.group_level, args.window, args.collapse)
+    while True:
+        watcher.poll(time.time())
+        time.sleep(args.interval)
+
+
+def reach(args):
+    # the counter file is a flat uint64_t array indexed by the slots in racebench_reach.json
+    with open(args.slot_map, "r") as f:
+        slots = json.load(f)
+    with open(args.counters, "rb") as f:
+        data = f.read()
+    counts = [x[0] for x in struct.iter_unpack("<Q", data[:len(data) // 8 * 8])]
+    counts += [0] * (len(slots) - len(counts))
+    bugs = dict()
+    for i, slot in enumerate(slots):
+        bugs.setdefault(slot["bug"], []).append((slot, counts[i]))
+    for bug, items in sorted(bugs.items()):
+        progress = []
+        for kind in ["site", "guard"]:
+            hits = [c for s, c in items if s["kind"] == kind]
+            progress.append("%ss %d/%d" % (kind, sum(map(bool, hits)), len(hits)))
+        print("bug %d: %s" % (bug, ", ".join(progress)))
+        for slot, count in items:
+            if args.verbose or count == 0:
+                print("  %s %s:%s %d" % (slot["kind"], slot["file"], slot.get("line", "?"), count))
+
+
+CsvColumns = ["group", "bug", "reps", "found_reps", "discovery_rate", "triggers", "total_run",
+              "trigger_per_run", "ttft_min", "ttft_median", "ttft_max"]
+
+
+def bulk(args):
+    import numpy
+    groups = dict()
+    for filename in find_stat_files(args.paths):
+        groups.setdefault(group_key(filename, args.group_level), []).append(filename)
+    results = {key: analyze_group(files, args.start) for key, files in sorted(groups.items())}
+
+    rows = []
+    for key, res in results.items():
+        print("%s: %d reps, %d runs, unique bugs per rep mean %.2f" % (
+            key, res["reps"], res["total_run"], res["unique_bugs"].mean()))
+        for bug in range(len(res["discovery_rate"])):
+            row = [key, bug, res["reps"], res["found_reps"][bug], res["discovery_rate"][bug],
+                   res["triggers"][bug], res["total_run"], res["trigger_per_run"][bug]]
+            if "ttft" in res:
+                row += [t if numpy.isfinite(t) else "" for t in
+                        (res["ttft_min"][bug], res["ttft_median"][bug], res["ttft_max"][bug])]
+            else:
+                row += ["", "", ""]
+            rows.append(row)
+            if res["found_reps"][bug] == 0:
+                continue
+            found = "  bug %d: found %d/%d" % (bug, res["found_reps"][bug], res["reps"])
+            if "ttft" in res:
+                found += ", ttft median %.0fs" % res["ttft_median"][bug]
+            print(found)
+
+    if args.csv is not None:
+        with open(args.csv, "w") as f:
+            f.write(",".join(CsvColumns) + "\n")
+            for row in rows:
+                f.write(",".join(str(x) for x in row) + "\n")
+    if args.npz is not None:
+        arrays = {"groups": numpy.array(list(results.keys()))}
+        for i, res in enumerate(results.values()):
+            for name in ["discovery_rate", "trigger_per_run", "ttft", "curve"]:
+                if name not in res:
+                    continue
+                arrays["%s_%d" % (name, i)] = res[name]
+        numpy.savez_compressed(args.npz, **arrays)
+
+
+def main():
+    modes = ["show", "bulk", "watch", "reach"]
+    argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] not in modes and not argv[0].startswith("-"):
+        # plain "stat_view.py <rb_stat>" still shows one file
+        argv.insert(0, "show")
+    parser = argparse.ArgumentParser(description="%(prog)s <rb_stat> is short for %(prog)s show <rb_stat>")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    p = sub.add_parser("show", help="print one stat file")
+    p.add_argument("stat_file")
+    p = sub.add_parser("bulk", help="aggregate many stat files (needs numpy)")
+    p.add_argument("paths", nargs="+", help="stat files, or directories searched for *.rb_stat")
+    p.add_argument("--group-level", type=int, default=1,
+                   help="group files by their n-th parent directory (default 1)")
+    p.add_argument("--start", type=float,
+                   help="start of every repetition as unix time, time to first trigger is only reported with it")
+    p.add_argument("--csv", help="write per-bug table as csv")
+    p.add_argument("--npz", help="write arrays (discovery rate, ttft, unique bug curve) as npz")
+    p = sub.add_parser("watch", help="poll stat files and report exec/s and new triggers")
+    p.add_argument("paths", nargs="+", help="stat files, or directories searched for *.rb_stat")
+    p.add_argument("--group-level", type=int, default=1,
+                   help="group files by their n-th parent directory (default 1)")
+    p.add_argument("--interval", type=float, default=10, help="seconds between polls")
+    p.add_argument("--window", type=float, default=300, help="seconds of the rolling exec/s window")
+    p.add_argument("--collapse", type=float, default=0.2,
+                   help="alert when exec/s falls below this fraction of its peak")
+    p = sub.add_parser("reach", help="per-bug progress from RB_REACH counters")
+    p.add_argument("counters", help="file given as RACEBENCH_REACH_FILE to a RACEBENCH_REACH build")
+    p.add_argument("slot_map", help="racebench_reach.json of the target")
+    p.add_argument("-v", "--verbose", action="store_true", help="list reached slots too")
+    args = parser.parse_args(argv)
+    if args.mode == "show":
+        show_file(args.stat_file)
+    elif args.mode == "bulk":
+        bulk(args)
+    elif args.mode == "reach":
+        reach(args)
+    elif args.mode == "watch":
+        try:
+            watch(args)
+        except KeyboardInterrupt:
+            pass
+
+
 if __name__ == "__main__":
     main()
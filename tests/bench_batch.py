@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# Time to check many mutated inputs against one bug order, batched and one by one.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import extract_bugs
+from test_batch import mutated_inputs
+from test_compiler import replay
+
+from batch import BatchChecker
+from compiler import CompiledCheckerExecutor
+
+
+def main():
+    lanes = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bugs = extract_bugs(os.path.join(tmpdir, "input"))
+    work = [(state.bug, mutated_inputs(state.input_bytes, lanes, seed)) for seed, (_, state) in enumerate(bugs)]
+
+    start = time.time()
+    sequential = []
+    for bug, inputs in work:
+        sequential.append([replay(bug, bug.order, CompiledCheckerExecutor(data))[1] for data in inputs])
+    compiled = time.time() - start
+
+    start = time.time()
+    batched = [list(BatchChecker(bug).run_inputs(inputs)) for bug, inputs in work]
+    batch = time.time() - start
+
+    assert batched == sequential
+    hits = sum(sum(x) for x in batched)
+    print("%d bugs, %d inputs each, %d triggering" % (len(work), lanes, hits))
+    print("compiled %.3fs, batched %.3fs, speedup %.2fx" % (compiled, batch, compiled / batch))
+
+
+if __name__ == "__main__":
+    main()
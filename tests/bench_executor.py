@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# Replay time of generated bugs with the interpreter and the compiled executor.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import extract_bugs
+
+from compiler import CompiledCheckerExecutor, PieceCompiler
+from executor import CheckerExecutor
+from simulate import ScheduleSimulator
+from test_compiler import replay
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bugs = extract_bugs(os.path.join(tmpdir, "input"))
+    random.seed(0)
+    work = []
+    for trace, state in bugs:
+        simulator = ScheduleSimulator(state.bug, state.input_bytes, trace.thread_step_rates())
+        work.append((state, [simulator.sample_order() for _ in range(samples)]))
+    steps = sum(len(order) for _, orders in work for order in orders)
+
+    start = time.time()
+    for state, orders in work:
+        for order in orders:
+            replay(state.bug, order, CheckerExecutor(state.input_bytes))
+    interp = time.time() - start
+
+    start = time.time()
+    for state, orders in work:
+        compiler = PieceCompiler(state.input_bytes)
+        for order in orders:
+            replay(state.bug, order, CompiledCheckerExecutor(state.input_bytes, compiler))
+    compiled = time.time() - start
+
+    print("%d bugs, %d orders, %d steps" % (len(work), len(work) * samples, steps))
+    print("interpreter %.3fs, compiled %.3fs, speedup %.2fx" % (interp, compiled, interp / compiled))
+
+
+if __name__ == "__main__":
+    main()
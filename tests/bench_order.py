@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# Size and read time of plain and run-length encoded order files.
+# usage: bench_order.py [repeat], each step is repeated up to repeat times like a spinning thread
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+from synthetic import extract_bugs
+from test_rle import with_repeats
+
+from rle import read_runs
+
+
+def read_lines(file_name):
+    with open(file_name, "r", encoding='latin-1') as f:
+        return sum(1 for _ in f)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bugs = extract_bugs(os.path.join(tmpdir, "input"))
+        plain, rle = os.path.join(tmpdir, "plain"), os.path.join(tmpdir, "rle")
+        sizes = [0, 0]
+        times = [0.0, 0.0]
+        steps = 0
+        for _, state in bugs:
+            state.bug.order = with_repeats(state.bug.order, repeat)
+            steps += len(state.bug.order)
+            state.bug.dump_order(plain)
+            state.bug.dump_order(rle, rle=True)
+            sizes[0] += os.path.getsize(plain)
+            sizes[1] += os.path.getsize(rle)
+            start = time.time()
+            read_lines(plain)
+            times[0] += time.time() - start
+            start = time.time()
+            sum(1 for _ in read_runs(rle))
+            times[1] += time.time() - start
+    print("%d bugs, %d steps, repeat up to %d" % (len(bugs), steps, repeat))
+    print("plain %.3f MB read in %.4fs, rle %.3f MB read in %.4fs" % (
+        sizes[0] / 2**20, times[0], sizes[1] / 2**20, times[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+/* RB_REACH cost in a loop shaped like injected code: a site counter, a guard
+   on a bug state variable, and a guard counter when it passes.
+   usage: bench_reach <threads> <iterations> <shared>
+   shared=1 puts every thread on the same slots, the worst case for the cache line */
+#include "racebench.h"
+#include <pthread.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#ifdef RACEBENCH_REACH
+static uint64_t counters[RB_REACH_SLOTS];
+uint64_t *rb_reach = counters;
+#endif
+
+static long iterations;
+static int shared;
+static volatile uint32_t sink;
+
+static void *worker(void *arg)
+{
+    /* 8 slots are one cache line, so own slots are not falsely shared */
+    int slot = shared ? 0 : 8 * (int)(long)arg;
+    uint32_t var = (uint32_t)(long)arg;
+    for (long i = 0; i < iterations; ++i) {
+        RB_REACH(slot);
+        var = var * 0x9e3779b1u + 0x7f4a7c15u;
+        if ((var & 0xffu) == 0x5au) { RB_REACH(slot + 1);
+            sink = var;
+        }
+    }
+    return NULL;
+}
+
+int main(int argc, char **argv)
+{
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s <threads> <iterations> <shared>\n", argv[0]);
+        return 1;
+    }
+    int threads = atoi(argv[1]);
+    iterations = atol(argv[2]);
+    shared = atoi(argv[3]);
+    if (threads < 1 || 8 * threads > RB_REACH_SLOTS) {
+        fprintf(stderr, "need 1 to %d threads\n", RB_REACH_SLOTS / 8);
+        return 1;
+    }
+    pthread_t tids[threads];
+    struct timespec start, end, cpu_start, cpu_end;
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &cpu_start);
+    for (long t = 0; t < threads; ++t)
+        pthread_create(&tids[t], NULL, worker, (void*)t);
+    for (int t = 0; t < threads; ++t)
+        pthread_join(tids[t], NULL);
+    clock_gettime(CLOCK_PROCESS_CPUTIME_ID, &cpu_end);
+    clock_gettime(CLOCK_MONOTONIC, &end);
+    /* wall and cpu seconds, cpu time adds up all threads */
+    printf("%.3f %.3f\n", (end.tv_sec - start.tv_sec) + (end.tv_nsec - start.tv_nsec) * 1e-9,
+           (cpu_end.tv_sec - cpu_start.tv_sec) + (cpu_end.tv_nsec - cpu_start.tv_nsec) * 1e-9);
+    return 0;
+}
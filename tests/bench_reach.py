@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# Overhead of RB_REACH: builds tests/bench_reach.c against the real racebench.h
+# with and without -DRACEBENCH_REACH and times both.
+# usage: bench_reach.py [threads] [iterations]
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# room for 8 threads with a cache line each
+Slots = 64
+
+
+def build(tmpdir: str, cc: str, reach: bool) -> str:
+    here = os.path.dirname(os.path.abspath(__file__))
+    exe = os.path.join(tmpdir, "reach_on" if reach else "reach_off")
+    cmd = [cc, "-O2", "-pthread", "-I", tmpdir, os.path.join(here, "bench_reach.c"), "-o", exe]
+    if reach:
+        cmd.insert(1, "-DRACEBENCH_REACH")
+    subprocess.run(cmd, check=True)
+    return exe
+
+
+def run(exe: str, threads: int, iterations: int, shared: int):
+    out = subprocess.run([exe, str(threads), str(iterations), str(shared)],
+                         check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    wall, cpu = out.split()
+    return float(wall), float(cpu)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 10 ** 8
+    cc = os.environ.get("CC") or shutil.which("gcc") or shutil.which("cc")
+    if cc is None:
+        print("no C compiler found")
+        sys.exit(1)
+    header = os.path.join(os.path.dirname(__file__), "..", "generate", "rbcode", "racebench.h")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(header) as f:
+            content = f.read()
+        defs = {"bug_num": 1, "arg_input": 1, "reach_slots": Slots}
+        for k, v in defs.items():
+            content = content.replace("{" + k + "}", str(v))
+        with open(os.path.join(tmpdir, "racebench.h"), "w") as f:
+            f.write(content)
+        off = build(tmpdir, cc, False)
+        on = build(tmpdir, cc, True)
+        print("%d threads x %d iterations, %d CPUs" % (threads, iterations, os.cpu_count() or 1))
+        for shared, name in [(0, "own slots"), (1, "shared slots")]:
+            wall_off, cpu_off = run(off, threads, iterations, shared)
+            wall_on, cpu_on = run(on, threads, iterations, shared)
+            print("%s: disabled %.3fs, enabled %.3fs wall, %.2f ns cpu per site visit" % (
+                name, wall_off, wall_on, (cpu_on - cpu_off) * 1e9 / (threads * iterations)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# Memory and time to parse and index a large synthetic gdb trace.
+# usage: bench_trace.py [events] [generate dir]
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+def write_log(path: str, events: int, threads: int = 4, files: int = 20):
+    r = random.Random(0)
+    with open(path, "w") as f:
+        for _ in range(events):
+            f.write("%d %s src/f%d.c:%d\n" % (
+                r.randrange(threads), r.choice("=>"), r.randrange(files), r.randrange(1, 2000)))
+
+
+def main():
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    gen_dir = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(__file__), "..", "generate")
+    sys.path.insert(0, gen_dir)
+    from tracer import Trace, parse_logs
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        log_path = os.path.join(tmpdir, "trace.log")
+        write_log(log_path, events)
+        tracemalloc.start()
+        start = time.time()
+        trace = Trace(parse_logs(log_path), {}, ".")
+        elapsed = time.time() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    print("%d events, %d threads: %.1f MB retained, %.1f MB peak, %.2fs" % (
+        len(trace) - 1, trace.num_threads, current / 2**20, peak / 2**20, elapsed))
+
+
+if __name__ == "__main__":
+    main()
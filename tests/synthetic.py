@@ -0,0 +1,48 @@
+# Bugs extracted from synthetic traces, for tests that need real generated code.
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "generate"))
+
+from tracer import Trace, ThreadPos
+from general import FileLine, LineLoc
+from bug_extract import BugExtractState
+from error import BugError
+
+
+class FakeDom:
+    def query(self, filename, line, mode):
+        return list(range(1, 200))
+
+
+def make_trace(seed: int, length: int = 400, threads: int = 3) -> Trace:
+    r = random.Random(seed)
+    positions = []
+    cur = [r.randrange(1, 50) for _ in range(threads)]
+    for i in range(length):
+        tid = r.randrange(threads) if i > 5 else 0
+        cur[tid] = (cur[tid] + r.randrange(1, 4)) % 60 + 1
+        loc = r.choice([LineLoc.Before, LineLoc.Before, LineLoc.Middle])
+        positions.append(ThreadPos(tid, loc, FileLine("f%d.c" % (cur[tid] % 2), cur[tid])))
+    return Trace(positions, {}, ".")
+
+
+def extract_bugs(input_file: str, seeds=range(20), path_len: int = 3):
+    # (trace, bug state) for every seed that yields a bug
+    with open(input_file, "wb") as f:
+        f.write(bytes(range(40)))
+    ans = []
+    for seed in seeds:
+        trace = make_trace(seed)
+        random.seed(seed)
+        for _ in range(30):
+            state = BugExtractState(0, trace, FakeDom(), lambda fl: fl.line % 7 != 0, input_file)
+            try:
+                state.add_bug(path_len)
+                state.implement()
+            except BugError:
+                continue
+            ans.append((trace, state))
+            break
+    return ans
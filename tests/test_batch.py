@@ -0,0 +1,64 @@
+# The batched executor must answer per input exactly like the compiled executor.
+import random
+
+import numpy
+import pytest
+
+from synthetic import extract_bugs
+from test_compiler import replay
+
+from batch import BatchChecker
+from compiler import CompiledCheckerExecutor
+from simulate import ScheduleSimulator
+
+
+def mutated_inputs(input_bytes, count, seed):
+    r = random.Random(seed)
+    inputs = [input_bytes, b""]
+    while len(inputs) < count:
+        data = bytearray(input_bytes)
+        for _ in range(r.randrange(1, 4)):
+            data[r.randrange(len(data))] = r.randrange(256)
+        inputs.append(bytes(data[:r.randrange(len(data) // 2, len(data) + 1)]))
+    return inputs
+
+
+@pytest.fixture(scope="module")
+def bugs(tmp_path_factory):
+    found = extract_bugs(str(tmp_path_factory.mktemp("bugs") / "input"))
+    assert len(found) >= 10
+    return found
+
+
+def check_lanes(bug, order, inputs):
+    executor = BatchChecker(bug).execute(inputs, order)
+    triggered = executor.triggered()
+    locked = executor.locked()
+    for lane, data in enumerate(inputs):
+        exp_locked, exp_trigger, exp_values, exp_skip = replay(bug, order, CompiledCheckerExecutor(data))
+        assert (bool(locked[lane]), bool(triggered[lane])) == (exp_locked, exp_trigger)
+        values = {name: int(executor.get_var(name)[lane]) for name in exp_values}
+        assert values == exp_values
+        assert int(executor.skip_level[lane]) == exp_skip
+    return triggered
+
+
+def test_inputs_over_bug_order(bugs):
+    hits = 0
+    for seed, (_, state) in enumerate(bugs):
+        inputs = mutated_inputs(state.input_bytes, 64, seed)
+        triggered = check_lanes(state.bug, state.bug.order, inputs)
+        assert triggered[0]
+        assert numpy.array_equal(BatchChecker(state.bug).run_inputs(inputs), triggered)
+        hits += int(triggered.sum())
+    # both answers must show up, or the test proves little
+    assert 0 < hits < 64 * len(bugs)
+
+
+def test_inputs_over_sampled_orders(bugs):
+    random.seed(0)
+    for seed, (trace, state) in enumerate(bugs):
+        simulator = ScheduleSimulator(state.bug, state.input_bytes, trace.thread_step_rates())
+        inputs = mutated_inputs(state.input_bytes, 16, seed)
+        for _ in range(5):
+            check_lanes(state.bug, simulator.sample_order(), inputs)
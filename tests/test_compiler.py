@@ -0,0 +1,57 @@
+# The compiled executor must replay generated bugs exactly like the interpreter.
+import random
+
+import pytest
+
+from synthetic import extract_bugs
+
+from bug import BugExecWrap
+from compiler import CompiledCheckerExecutor, PieceCompiler
+from error import LockError
+from executor import CheckerExecutor, InterleaveExec
+from simulate import ScheduleSimulator
+
+
+def replay(bug, order, executor):
+    wrap = BugExecWrap(bug, executor)
+    ix = InterleaveExec(order, wrap.execute, wrap.max_code_ptr)
+    try:
+        while ix.next():
+            pass
+    except LockError:
+        locked = True
+    else:
+        locked = False
+    values = {var.name: executor.state.get_var(var.name) for var in bug.all_vars}
+    return locked, executor.has_triggered(), values, executor.state.skip_level
+
+
+def inputs_for(input_bytes):
+    r = random.Random(len(input_bytes))
+    return [input_bytes, b"", bytes(r.randrange(256) for _ in range(len(input_bytes)))]
+
+
+@pytest.fixture(scope="module")
+def bugs(tmp_path_factory):
+    found = extract_bugs(str(tmp_path_factory.mktemp("bugs") / "input"))
+    assert len(found) >= 10
+    return found
+
+
+def test_bug_order_matches(bugs):
+    for _, state in bugs:
+        for data in inputs_for(state.input_bytes):
+            expected = replay(state.bug, state.bug.order, CheckerExecutor(data))
+            assert replay(state.bug, state.bug.order, CompiledCheckerExecutor(data)) == expected
+
+
+def test_sampled_orders_match(bugs):
+    random.seed(0)
+    for trace, state in bugs:
+        simulator = ScheduleSimulator(state.bug, state.input_bytes, trace.thread_step_rates())
+        compiler = PieceCompiler(state.input_bytes)
+        for _ in range(30):
+            order = simulator.sample_order()
+            expected = replay(state.bug, order, CheckerExecutor(state.input_bytes))
+            actual = replay(state.bug, order, CompiledCheckerExecutor(state.input_bytes, compiler))
+            assert actual == expected
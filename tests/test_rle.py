@@ -0,0 +1,49 @@
+# Run-length encoded orders must expand to exactly the plain order file.
+import pytest
+
+from synthetic import extract_bugs
+
+from general import Interleave
+from rle import is_rle_file, plain_file, read_runs
+
+
+@pytest.fixture(scope="module")
+def bugs(tmp_path_factory):
+    return extract_bugs(str(tmp_path_factory.mktemp("bugs") / "input"))
+
+
+def with_repeats(order, repeat):
+    # a thread spinning on one line repeats the same entry
+    ans = Interleave()
+    for idx in range(len(order)):
+        for _ in range(1 + idx % repeat):
+            ans.append_step(order, idx)
+    return ans
+
+
+def test_rle_expands_to_plain(bugs, tmp_path):
+    plain, rle = str(tmp_path / "plain"), str(tmp_path / "rle")
+    for _, state in bugs:
+        bug = state.bug
+        original = bug.order
+        for repeat in [1, 5]:
+            bug.order = with_repeats(original, repeat)
+            bug.dump_order(plain)
+            bug.dump_order(rle, rle=True)
+            assert not is_rle_file(plain) and is_rle_file(rle)
+            with open(plain) as f:
+                expected = f.read()
+            with plain_file(rle) as expanded, open(expanded) as f:
+                assert f.read() == expected
+            with plain_file(plain) as same:
+                assert same == plain
+            assert sum(n for _, n in read_runs(rle)) == len(bug.order)
+            assert [line for line, _ in read_runs(plain)] == expected.splitlines()
+        bug.order = original
+
+
+def test_runs_collapse_identical_steps(bugs):
+    order = with_repeats(bugs[0][1].bug.order, 5)
+    runs = list(order.runs())
+    assert sum(n for _, n in runs) == len(order)
+    assert len(runs) == len(bugs[0][1].bug.order)
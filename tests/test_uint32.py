@@ -0,0 +1,185 @@
+# Differential tests of the wrapping uint32 engine against numpy.uint32,
+# which the generator used before, and against the C it renders.
+import itertools
+import os
+import random
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "generate"))
+
+from uint32 import Mask, c_literal, eval_op, u32
+from executor import CodePieceExecutor, eval_input
+from piece import Expression, InputValue
+
+numpy = pytest.importorskip("numpy")
+U32 = numpy.uint32
+
+Edges = [0, 1, 2, 0x7f, 0xff, 0x7fffffff, 0x80000000, 0x80000001, 0xfffffffe, 0xffffffff]
+
+
+def numpy_eval_op(op, args):
+    args = [U32(a) for a in args]
+    with numpy.errstate(over="ignore"):
+        if op == "+":
+            return numpy.sum(args, dtype=U32)
+        if op == "^":
+            ans = args[0]
+            for a in args[1:]:
+                ans = ans ^ a
+            return ans
+        if op == "-":
+            return -args[0] if len(args) == 1 else args[0] - args[1]
+        if op == "!":
+            return U32(args[0] == 0)
+        if op == "==":
+            return U32(args[0] == args[1])
+        if op == "!=":
+            return U32(args[0] != args[1])
+        if op == "&&":
+            return U32(bool(args[0]) and bool(args[1]))
+        if op == "?:":
+            return args[1] if args[0] else args[2]
+    raise NotImplementedError
+
+
+def values(n=200, seed=0):
+    r = random.Random(seed)
+    return Edges + [r.randrange(1 << 32) for _ in range(n)]
+
+
+def check(op, args):
+    ans = eval_op(op, list(args))
+    assert type(ans) is int and 0 <= ans <= Mask
+    assert ans == int(numpy_eval_op(op, args)), (op, args)
+
+
+@pytest.mark.parametrize("arity", [2, 3, 5])
+def test_add_wraps(arity):
+    r = random.Random(arity)
+    for args in itertools.product(Edges, repeat=2):
+        check("+", args)
+    for _ in range(500):
+        check("+", [r.choice(values()) for _ in range(arity)])
+
+
+def test_xor():
+    for args in itertools.product(values(30), repeat=2):
+        check("^", args)
+    check("^", [0xffffffff, 0x80000000, 1])
+
+
+def test_sub_and_negation():
+    for a in values():
+        check("-", [a])
+    for args in itertools.product(values(30), repeat=2):
+        check("-", args)
+
+
+@pytest.mark.parametrize("op", ["!", "==", "!=", "&&"])
+def test_logic(op):
+    for a in values(30):
+        if op == "!":
+            check(op, [a])
+            continue
+        for b in values(30):
+            check(op, [a, b])
+        check(op, [a, a])
+
+
+def test_conditional():
+    for c, a, b in itertools.product(values(10), repeat=3):
+        check("?:", [c, a, b])
+
+
+def test_unknown_op():
+    with pytest.raises(NotImplementedError):
+        eval_op("*", [1, 2])
+    with pytest.raises(NotImplementedError):
+        eval_op("!", [1, 2])
+
+
+def test_input_bytes():
+    data = bytes(range(256))
+    for index in [0, 1, 127, 128, 255, 256, 1000]:
+        for fall_back in [0, 0xffffffff, 0x80000000]:
+            iv = InputValue(index, fall_back)
+            ans = eval_input(data, iv)
+            ref = U32(data[index]) if index < len(data) else U32(fall_back)
+            assert type(ans) is int and ans == int(ref)
+
+
+def test_u32_and_literal():
+    for a in [-1, -(1 << 32), 1 << 32, (1 << 33) + 5] + values(50):
+        assert u32(a) == int(numpy.array(a % (1 << 64), dtype=numpy.uint64).astype(U32))
+        assert int(c_literal(a)[:-1], 16) == u32(a)
+        assert c_literal(a).endswith("u")
+
+
+def random_expr(r, names, input_len, depth, top=True):
+    if depth == 0 or (not top and r.random() < 0.25):
+        kind = r.randrange(3)
+        if kind == 0:
+            return r.choice(names)
+        if kind == 1:
+            return r.choice(values(5, r.randrange(1000)))
+        return InputValue(r.randrange(input_len + 3), r.choice(Edges))
+    op, arity = r.choice([("+", 2), ("^", 2), ("-", 1), ("-", 2), ("!", 1),
+                          ("==", 2), ("!=", 2), ("&&", 2), ("?:", 3)])
+    return Expression(op, [random_expr(r, names, input_len, depth - 1, False) for _ in range(arity)])
+
+
+def test_rendered_c_matches(tmp_path):
+    # the generated C must compute exactly what the generator assumed
+    cc = os.environ.get("CC") or shutil.which("gcc") or shutil.which("cc")
+    if cc is None:
+        pytest.skip("no C compiler")
+    r = random.Random(0)
+    names = ["v%d" % i for i in range(4)]
+    cases = []
+    for case in range(20):
+        input_bytes = bytes(r.randrange(256) for _ in range(r.randrange(0, 8)))
+        var_values = [r.choice(values(5, case)) for _ in names]
+        exprs = [random_expr(r, names, len(input_bytes), 3) for _ in range(100)]
+        cases.append((input_bytes, var_values, exprs))
+
+    lines = ["#include <stdint.h>", "#include <stdio.h>",
+             "static uint64_t rb_input_size;", "static uint8_t *rb_input;",
+             "static uint32_t %s;" % ", ".join(names)]
+    # one function per case, a single huge main takes long to optimize
+    for case, (input_bytes, var_values, exprs) in enumerate(cases):
+        data = ", ".join(str(b) for b in input_bytes) or "0"
+        lines.append("static void case_%d(void)" % case)
+        lines.append("{")
+        lines.append("    static uint8_t data[] = {%s};" % data)
+        lines.append("    rb_input = data; rb_input_size = %d;" % len(input_bytes))
+        for name, value in zip(names, var_values):
+            lines.append("    %s = %s;" % (name, c_literal(value)))
+        for expr in exprs:
+            lines.append("    printf(\"%%u\\n\", (uint32_t)(%s));" % expr)
+        lines.append("}")
+    lines += ["int main(void)", "{"]
+    lines += ["    case_%d();" % case for case in range(len(cases))]
+    lines += ["    return 0;", "}"]
+    src = tmp_path / "exprs.c"
+    src.write_text("\n".join(lines) + "\n")
+
+    exe = str(tmp_path / "exprs")
+    flags = ["-O1", "-fsanitize=undefined", "-fno-sanitize-recover=undefined"]
+    if subprocess.run([cc] + flags + [str(src), "-o", exe]).returncode != 0:
+        # no ubsan runtime, still compare the values
+        subprocess.run([cc, "-O1", str(src), "-o", exe], check=True)
+    out = subprocess.run([exe], check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+
+    expected = []
+    for input_bytes, var_values, exprs in cases:
+        executor = CodePieceExecutor(input_bytes)
+        for name, value in zip(names, var_values):
+            executor.state.set_var(name, value)
+        expected += [str(executor.eval_expr(expr)) for expr in exprs]
+    assert len(out) == len(expected)
+    for text, ans, expr in zip(out, expected, itertools.chain(*(c[2] for c in cases))):
+        assert text == ans, str(expr)